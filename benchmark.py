@@ -0,0 +1,159 @@
+import argparse
+import json
+import shutil
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from chan.fractal import Fractal
+from chan.layer import Interval
+from chan.pivot import StrokePivot, SegmentPivot
+from chan.segment import Segment
+from chan.source import Source
+from chan.stick import Stick
+from chan.stroke import Stroke
+from chan.summary import SummaryIndex
+from stockdata import StockData
+
+BASELINE = Path(__file__).parent / "benchmark.json"
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+KINDS = ["walk", "trend", "choppy"]
+
+# 模拟K线的时间间隔（和保存K线的周期一致，接口按周期的日期格式输出时不会重复）
+FREQUENCIES = {Interval.MIN_1: "1min", Interval.MIN_5: "5min", Interval.MIN_30: "30min",
+               Interval.HOUR_1: "1h", Interval.DAY_1: "B", Interval.WEEK_1: "W-MON", Interval.MONTH_1: "MS"}
+
+
+# 生成模拟K线（开盘价、最高价、最低价、收盘价、成交量），相同参数生成的数据相同
+#   walk：随机游走；trend：带漂移的随机游走；choppy：围绕均值来回震荡
+def generate_bars(kind, size, seed=0, freq="1min"):
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 1, size)
+    if kind == "choppy":
+        # 均值回归（指数平均等价于每步向均值回拉2%）
+        close = 100 + pd.Series(steps / 0.02).ewm(alpha=0.02, adjust=False).mean().to_numpy() * 0.1
+    else:
+        if kind == "trend":
+            steps += 0.1
+        close = 100 + np.cumsum(steps) * 0.1
+    close = np.maximum(close, 1)
+
+    open_ = np.concatenate([close[:1], close[:-1]]) + rng.normal(0, 0.05, size)
+    high = np.maximum(open_, close) + np.abs(rng.normal(0, 0.1, size))
+    low = np.minimum(open_, close) - np.abs(rng.normal(0, 0.1, size))
+    index = pd.date_range("2000-01-03 09:30", periods=size, freq=freq, tz="America/New_York", name="Date")
+    bars = pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close,
+                         "Volume": rng.integers(100, 10_000, size)}, index=index)
+    return Source.calculate_macd(bars)
+
+
+# 对一组模拟K线运行所有层，返回每层的耗时、峰值内存和每秒处理的行数
+#   日线以上的周期可以生成的K线数量受时间戳范围限制（日线约15万根），默认使用1分钟线
+def run(kind, size, seed=0, memory=True, stockdata=False, interval=Interval.MIN_1):
+    source = Source(f"BENCH-{kind}-{size}")
+    source.data[interval.value] = generate_bars(kind, size, seed, FREQUENCIES[interval])
+
+    stick = Stick(source)
+    fractal = Fractal(stick)
+    stroke = Stroke(fractal)
+    segment = Segment(stroke)
+    layers = [stick, fractal, stroke, StrokePivot(stroke), segment, SegmentPivot(segment)]
+
+    results = {}
+    for layer in layers:
+        data = layer.parent.get_frame(interval)
+        results[layer.name] = measure(lambda: layer.generate(auto_save=False, intervals=[interval]),
+                                      len(data), memory)
+        results[layer.name]["rows_out"] = len(layer.get_frame(interval))
+
+    # 接口加载数据需要先保存文件，测完删除
+    if stockdata:
+        try:
+            for layer in [source] + layers:
+                layer.save()
+            results["stockdata"] = measure(lambda: StockData().load(source.symbol, interval.value),
+                                           size, memory)
+        finally:
+            shutil.rmtree(source.path, ignore_errors=True)
+            SummaryIndex.shared().remove(source.symbol)
+    return results
+
+
+# 测量一次调用的耗时和峰值内存（tracemalloc会拖慢速度，耗时单独测量）
+def measure(function, rows, memory=True):
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak, "rows_per_second": rows / seconds if seconds > 0 else None}
+
+
+# 和基准结果比较，耗时超过基准的(1 + tolerance)倍则记为退化
+def compare(results, baseline, tolerance=0.25):
+    regressions = []
+    for case, layers in results.items():
+        for name, result in layers.items():
+            expected = baseline.get(case, {}).get(name)
+            if expected is None or expected["seconds"] < 0.01:
+                continue
+            ratio = result["seconds"] / expected["seconds"]
+            if ratio > 1 + tolerance:
+                regressions.append((case, name, ratio))
+    return regressions
+
+
+def report(results):
+    for case, layers in results.items():
+        print(case)
+        for name, result in layers.items():
+            peak = f"{result['peak_bytes'] / 1e6:9.1f}MB" if result["peak_bytes"] is not None else "        -"
+            speed = f"{result['rows_per_second']:12,.0f} rows/s" if result["rows_per_second"] else ""
+            print(f"  {name:<14}{result['seconds']:9.3f}s {peak} {speed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="缠论各层性能测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES[:4])
+    parser.add_argument("--kinds", nargs="+", default=KINDS, choices=KINDS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--interval", default=Interval.MIN_1.value, choices=[interval.value for interval in Interval])
+    parser.add_argument("--no-memory", action="store_true", help="不测量峰值内存")
+    parser.add_argument("--stockdata", action="store_true", help="同时测量StockData.load")
+    parser.add_argument("--save", action="store_true", help="保存为新的基准结果")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    interval = Interval(args.interval)
+    results = {}
+    for size in args.sizes:
+        for kind in args.kinds:
+            case = f"{kind}-{size}-{interval.value}"
+            results[case] = run(kind, size, args.seed, not args.no_memory, args.stockdata, interval)
+            report({case: results[case]})
+
+    if args.save:
+        baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+        baseline.update(results)
+        BASELINE.write_text(json.dumps(baseline, indent=2, sort_keys=True))
+        print(f"Saved baseline to {BASELINE}")
+    elif BASELINE.exists():
+        regressions = compare(results, json.loads(BASELINE.read_text()), args.tolerance)
+        for case, name, ratio in regressions:
+            print(f"REGRESSION {case} {name}: {ratio:.2f}x baseline")
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,350 @@
+import numpy as np
 import pandas as pd
 
-from chan.layer import Layer
+from chan import macd
+from chan.fractal import Fractal, FractalList
+from chan.layer import Layer, Interval
+from chan.pivot import Pivot
+from chan.segment import Segment
+from chan.source import Source
+from chan.stick import Stick
+from chan.stroke import Stroke
 
 
-# 缠论背驰类
+# 缠论背驰类：比较相邻两个同方向的笔或线段（中间隔着一个反方向的笔或线段，即构成中枢的重叠部分），
+# 后一个创出新高（新低）但MACD红柱（绿柱）面积更小，则后一个的终点为背驰点
+#   顶背驰只有最高价，底背驰只有最低价，Area为后一个的面积，Previous为前一个的面积
+#   面积用柱状图的前缀和计算，每次比较只需要两个端点的前缀和
+#   进入、离开完整中枢的笔或线段之间的比较见PivotDivergence
 class Divergence(Layer):
 
+    def __init__(self, parent):
+        super().__init__(parent)
+
+        # 增量更新时数据源已确认K线的时间和红柱、绿柱前缀和（已确认的K线不会再变化，只追加新确认的部分）
+        self.prefix = {interval.value: None for interval in Interval}
+        self.interval = None
+
     # 生成一个时间周期的数据（判断背驰）
     def generate_interval(self, interval, data):
-        # 初始化空的背驰数据集
-        divergences = pd.DataFrame(columns=["High", "Low"])
+        self.prefix[interval.value] = None
+        fractals = FractalList.of(data)
+        if len(fractals) < 4:
+            return self._to_frame([])
+
+        kind, price, area = self._areas(interval, fractals)
+        top = kind == FractalList.TOP
+
+        # 和前一个同方向的笔或线段比较价格和面积
+        same = kind[2:] == kind[:-2]
+        higher = np.where(top[2:], price[2:] > price[:-2], price[2:] < price[:-2])
+        weaker = area[2:] < area[:-2]
+        found = np.flatnonzero(same & higher & weaker) + 2
+        return self._found(fractals, found, found - 2, area)
+
+    # 逐行判断背驰（参考实现，用于校验前缀和的结果）
+    def generate_interval_by_row(self, interval, data):
+        divergences = pd.DataFrame(columns=["High", "Low", "Area", "Previous"])
+        areas = self._areas_by_row(interval, data)
+        for index in range(2, len(areas)):
+            self._keep_by_row(divergences, areas[index], areas[index - 2])
+        return divergences
+
+    # 增量更新（记录本次更新的周期，获取数据项时需要数据源的柱状图）
+    def update(self, interval):
+        if self.streams[interval.value] is None:
+            self.prefix[interval.value] = None
+        self.interval = interval
+        return super().update(interval)
+
+    # 增量判断背驰的初始状态（最后两个端点和以它们为终点的笔或线段的面积）
+    def _new_state(self):
+        return {"fractals": []}
+
+    # 增量判断背驰（结果和generate_interval一致），每个端点只和前两个端点比较，结果不会再变化
+    def _scan(self, state, items):
+        fractals = state["fractals"]
+        divergences = []
+        for date, kind, price, red, green in items:
+            area = np.nan
+            if fractals:
+                area = self._area(kind, fractals[-1], red, green)
+            if len(fractals) == 2:
+                first = fractals[0]
+                if first["kind"] == kind and self._diverge(kind, price, area, first["price"], first["area"]):
+                    divergences.append(self._item(date, kind, price, area, first["area"]))
+                del fractals[0]
+            fractals.append({"kind": kind, "price": price, "red": red, "green": green, "area": area})
+        return divergences
+
+    # 从笔或线段数据集获取端点数据项（时间、类型、价格、数据源中到端点为止的红柱和绿柱前缀和）
+    def _items(self, data, start):
+        fractals = FractalList.from_frame(data, start)
+        red, green = self._cumulative(self.interval, fractals.date)
+        return list(zip(fractals.date, fractals.kind.tolist(), fractals.price.tolist(), red, green))
+
+    # 背驰数据项转换为数据集
+    def _to_frame(self, items):
+        if len(items) == 0:
+            return pd.DataFrame(columns=["High", "Low", "Area", "Previous"])
+        dates, highs, lows, areas, previous = zip(*items)
+        return pd.DataFrame({"High": highs, "Low": lows, "Area": areas, "Previous": previous},
+                            index=pd.Index(dates))
+
+    # 每个端点的类型、价格和以它为终点的笔或线段的面积（起点之后到终点的K线，向上取红柱面积，向下取绿柱面积）
+    def _areas(self, interval, fractals):
+        source = self._get_source().get_data(interval)
+        red, green = macd.prefix(source["Histogram"])
+        # 每个端点的前缀和（到端点K线为止，包含端点K线）
+        positions = source.index.searchsorted(fractals.date) + 1
+        area = macd.areas(fractals.kind == FractalList.TOP, red[positions], green[positions])
+        return fractals.kind, fractals.price, area
+
+    # 找到的背驰（终点位置和比较的前一个位置）转换为数据集
+    @staticmethod
+    def _found(fractals, found, previous, area):
+        top = fractals.kind[found] == FractalList.TOP
+        price = fractals.price[found]
+        return pd.DataFrame({"High": np.where(top, price, np.nan), "Low": np.where(top, np.nan, price),
+                             "Area": area[found], "Previous": area[previous]},
+                            index=fractals.date[found])
+
+    # 按顺序累加数据源的柱状图，逐行计算每个端点的类型、价格和面积（时间、是否为顶分型、价格、面积）
+    def _areas_by_row(self, interval, data):
         if len(data) == 0:
-            return divergences
+            return []
+        dates = set(data.index)
+        totals = {}
+        red = green = 0.0
+        source = self._get_source().get_data(interval)
+        for date, value in zip(source.index, source["Histogram"]):
+            value = 0.0 if np.isnan(value) else float(value)
+            red += max(value, 0.0)
+            green += min(value, 0.0)
+            if date in dates:
+                totals[date] = (red, green)
+
+        areas = []
+        previous = None
+        for index in range(len(data)):
+            item = self._get_item(data, index)
+            top = self._is_top(item)
+            red, green = totals[item.name]
+            area = np.nan
+            if previous is not None:
+                area = red - previous[0] if top else previous[1] - green
+            areas.append((item.name, top, item["High"] if top else item["Low"], area))
+            previous = red, green
+        return areas
+
+    # 比较两个端点（时间、是否为顶分型、价格、面积），后一个背驰时保存
+    def _keep_by_row(self, divergences, current, previous):
+        date, top, price, area = current
+        kind = FractalList.TOP if top else FractalList.BOTTOM
+        if top == previous[1] and self._diverge(kind, price, area, previous[2], previous[3]):
+            item = self._item(date, kind, price, area, previous[3])
+            self._keep_item(divergences, pd.Series(item[1:], index=["High", "Low", "Area", "Previous"], name=date))
+
+    # 以端点为终点的笔或线段的面积（前一个端点的前缀和之后，向上取红柱面积，向下取绿柱面积）
+    @staticmethod
+    def _area(kind, last, red, green):
+        return red - last["red"] if kind == FractalList.TOP else last["green"] - green
+
+    # 后一个创出新高（新低）且面积更小
+    @staticmethod
+    def _diverge(kind, price, area, previous_price, previous_area):
+        higher = price > previous_price if kind == FractalList.TOP else price < previous_price
+        return higher and area < previous_area
+
+    # 背驰数据项（时间、最高价、最低价、面积、前一个面积）
+    @staticmethod
+    def _item(date, kind, price, area, previous):
+        return (date, price if kind == FractalList.TOP else np.nan,
+                np.nan if kind == FractalList.TOP else price, area, previous)
+
+    # 数据源中到指定时间为止的红柱和绿柱前缀和：已确认的K线使用缓存，只对新确认的K线累加，
+    # 尚未确认的K线每次重新计算（只读取缓存之后的K线，不合并数据源的完整数据集）
+    def _cumulative(self, interval, dates):
+        if len(dates) == 0:
+            return [], []
+        source = self._get_source()
+        cache = self.prefix[interval.value]
+        if cache is None:
+            cache = self.prefix[interval.value] = {"count": 0, "dates": np.empty(0, dtype=np.int64),
+                                                   "red": np.zeros(1), "green": np.zeros(1)}
+        rows = source.get_rows(interval, cache["count"])
+        count = min(source.get_confirmed(interval), cache["count"] + len(rows))
+        confirmed, rows = rows.iloc[:count - cache["count"]], rows.iloc[count - cache["count"]:]
+        if len(confirmed) > 0:
+            red, green = macd.prefix(confirmed["Histogram"], cache["red"][count - len(confirmed)],
+                                      cache["green"][count - len(confirmed)])
+            self._extend(cache, "dates", count - len(confirmed), self._nanoseconds(confirmed.index))
+            self._extend(cache, "red", count - len(confirmed) + 1, red[1:])
+            self._extend(cache, "green", count - len(confirmed) + 1, green[1:])
+            cache["count"] = count
+        tail_red, tail_green = macd.prefix(rows["Histogram"], cache["red"][count], cache["green"][count])
+
+        # 前缀和的位置（到端点K线为止），已确认的K线之后的从尾部的前缀和中取
+        dates = self._nanoseconds(dates)
+        positions = cache["dates"][:count].searchsorted(dates)
+        tail = np.where(positions < count, 0, self._nanoseconds(rows.index).searchsorted(dates) + 1)
+        positions = positions + 1
+        red = np.where(tail == 0, cache["red"][np.minimum(positions, count)], tail_red[tail])
+        green = np.where(tail == 0, cache["green"][np.minimum(positions, count)], tail_green[tail])
+        return red.tolist(), green.tolist()
+
+    # 追加到缓存数组的指定位置，容量不够时加倍（追加的耗时和追加的数量成正比）
+    @staticmethod
+    def _extend(cache, name, position, values):
+        array = cache[name]
+        if position + len(values) > len(array):
+            array = np.resize(array, max(position + len(values), len(array) * 2))
+            cache[name] = array
+        array[position:position + len(values)] = values
+
+    # 时间转换为UTC纳秒数（用于在缓存的时间中查找）
+    @staticmethod
+    def _nanoseconds(dates):
+        return pd.to_datetime(dates, utc=True).asi8
+
+    # 数据源层
+    def _get_source(self):
+        layer = self
+        while layer.parent is not None:
+            layer = layer.parent
+        return layer
+
+
+# 中枢背驰：进入中枢和离开中枢的笔或线段方向相同，离开的创出新高（新低）但面积更小，则离开的终点为背驰点
+#   中枢和中枢层使用同一个引擎构建（同方向重叠的中枢合并后只比较进入第一个、离开最后一个的笔或线段），
+#   Area为离开中枢的面积，Previous为进入中枢的面积
+class PivotDivergence(Divergence):
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.pivot = Pivot(parent)
+
+    # 生成一个时间周期的数据（判断进入、离开中枢的背驰）
+    def generate_interval(self, interval, data):
+        self.prefix[interval.value] = None
+        fractals = FractalList.of(data)
+        pivots, _ = Pivot._find_pivots(fractals.kind, fractals.price, True)
+        if len(pivots) == 0:
+            return self._to_frame([])
+
+        kind, price, area = self._areas(interval, fractals)
+        # 进入中枢的笔或线段以中枢起点为终点，离开中枢的以中枢终点的下一个端点为终点
+        entering = np.array([pivot[0] for pivot in pivots], dtype=np.intp)
+        leaving = np.array([pivot[1] for pivot in pivots], dtype=np.intp) + 1
+        top = kind[leaving] == FractalList.TOP
+        higher = np.where(top, price[leaving] > price[entering], price[leaving] < price[entering])
+        weaker = area[leaving] < area[entering]
+        found = np.flatnonzero(higher & weaker)
+        return self._found(fractals, leaving[found], entering[found], area)
+
+    # 逐行判断中枢背驰（参考实现，中枢使用中枢层的逐行参考实现）
+    def generate_interval_by_row(self, interval, data):
+        divergences = pd.DataFrame(columns=["High", "Low", "Area", "Previous"])
+        pivots = self.pivot.generate_interval_by_row(interval, data)
+        areas = self._areas_by_row(interval, data)
+        positions = {date: index for index, date in enumerate(data.index)}
+        for index in range(0, len(pivots) - 1, 2):
+            entering = positions[pivots.index[index]]
+            leaving = positions[pivots.index[index + 1]] + 1
+            self._keep_by_row(divergences, areas[leaving], areas[entering])
+        return divergences
 
+    # 增量判断中枢背驰的初始状态（中枢引擎的状态、还可能用到的端点、最后一个端点）
+    def _new_state(self):
+        return {"pivot": self.pivot._new_state(), "endpoints": {}, "last": None}
+
+    # 复制状态（中枢引擎的状态也要复制）
+    def _copy_state(self, state):
+        return {"pivot": self.pivot._copy_state(state["pivot"]), "endpoints": dict(state["endpoints"]),
+                "last": state["last"]}
+
+    # 增量判断中枢背驰：端点交给中枢引擎，中枢确定（不会再和后面的中枢合并）后比较进入、离开的笔或线段
+    def _scan(self, state, items):
+        endpoints = state["endpoints"]
+        fractals = []
+        for item, red, green in items:
+            area = np.nan
+            if state["last"] is not None:
+                area = self._area(item.kind, state["last"], red, green)
+            endpoints[item.position] = (item, area)
+            state["last"] = {"red": red, "green": green}
+            fractals.append(item)
+        divergences = self._compare(endpoints, self.pivot._scan(state["pivot"], fractals))
+
+        # 中枢引擎还保留的端点和还没有确定的中枢之前的端点以后都不会再用到
+        pending = state["pivot"]["fractals"][:1] + [pivot[0] for pivot in state["pivot"]["pivots"]]
+        if pending:
+            floor = min(item.position for item in pending)
+            for position in [position for position in endpoints if position < floor]:
+                del endpoints[position]
         return divergences
+
+    # 输入结束，比较剩余的中枢
+    def _finish(self, state):
+        return self._compare(state["endpoints"], self.pivot._finish(state["pivot"]))
+
+    # 从笔或线段数据集获取分型数据项和数据源中到端点为止的红柱、绿柱前缀和
+    def _items(self, data, start):
+        fractals = FractalList.from_frame(data, start)
+        red, green = self._cumulative(self.interval, fractals.date)
+        return list(zip(fractals.items(), red, green))
+
+    # 比较确定的中枢进入、离开的笔或线段（中枢的起点、终点为分型数据项）
+    def _compare(self, endpoints, pivots):
+        divergences = []
+        for pivot in pivots:
+            entering, entering_area = endpoints[pivot[0].position]
+            leaving, area = endpoints[pivot[1].position + 1]
+            if self._diverge(leaving.kind, leaving.price, area, entering.price, entering_area):
+                divergences.append(self._item(leaving.date, leaving.kind, leaving.price, area, entering_area))
+        return divergences
+
+
+class StrokeDivergence(Divergence):
+    pass
+
+
+class SegmentDivergence(Divergence):
+    pass
+
+
+class StrokePivotDivergence(PivotDivergence):
+    pass
+
+
+class SegmentPivotDivergence(PivotDivergence):
+    pass
+
+
+if __name__ == '__main__':
+    source = Source("000001.SS")
+    source.load()
+
+    stick = Stick(source)
+    stick.load()
+
+    fractal = Fractal(stick)
+    fractal.load()
+
+    stroke = Stroke(fractal)
+    stroke.load()
+
+    strokeDivergence = StrokeDivergence(stroke)
+    strokeDivergence.generate()
+
+    strokePivotDivergence = StrokePivotDivergence(stroke)
+    strokePivotDivergence.generate()
+
+    segment = Segment(stroke)
+    segment.load()
+
+    segmentDivergence = SegmentDivergence(segment)
+    segmentDivergence.generate()
+
+    segmentPivotDivergence = SegmentPivotDivergence(segment)
+    segmentPivotDivergence.generate()
@@ -6,6 +6,104 @@ from chan.source import Source
 from chan.stick import Stick
 
 
+# 紧凑分型列表，只保存真正的分型（位置、类型、价格、时间的平行数组），
+# 分型层生成的列表还保存完整索引（包括不是分型的线），保存文件和接口输出时按位置补齐空行
+class FractalList:
+    __slots__ = ("position", "kind", "price", "date", "index")
+
+    # 分型类型
+    TOP = 1
+    BOTTOM = -1
+    NONE = 0
+
+    def __init__(self, position, kind, price, date, index=None):
+        self.position = position
+        self.kind = kind
+        self.price = price
+        self.date = date
+        self.index = index
+
+    def __len__(self):
+        return len(self.position)
+
+    # 从数据集转换（顶分型只有最高价，底分型只有最低价，其余行不是分型），位置从start开始计数
+    @classmethod
+    def from_frame(cls, data, start=0):
+        high = data["High"].to_numpy(dtype=float)
+        low = data["Low"].to_numpy(dtype=float)
+        top = np.isnan(low) & ~np.isnan(high)
+        bottom = np.isnan(high) & ~np.isnan(low)
+
+        position = np.flatnonzero(top | bottom)
+        kind = np.where(top[position], cls.TOP, cls.BOTTOM).astype(np.int8)
+        price = np.where(top[position], high[position], low[position])
+        return cls(position + start, kind, price, data.index[position])
+
+    # 从分型数据项转换
+    @classmethod
+    def from_items(cls, items):
+        return cls(np.array([item.position for item in items], dtype=np.intp),
+                   np.array([item.kind for item in items], dtype=np.int8),
+                   np.array([item.price for item in items], dtype=float),
+                   pd.Index([item.date for item in items]))
+
+    # 统一转换为紧凑分型列表
+    @classmethod
+    def of(cls, data):
+        return data if isinstance(data, cls) else cls.from_frame(data)
+
+    # 逐个获取分型数据项
+    def items(self):
+        for position, kind, price, date in zip(self.position.tolist(), self.kind.tolist(),
+                                               self.price.tolist(), self.date):
+            yield FractalItem(position, kind, price, date)
+
+    # 转换为数据集，指定完整索引时按位置补齐非分型的空行（兼容原有CSV格式）
+    def to_frame(self, index=None):
+        top = self.kind == self.TOP
+        if index is None:
+            return pd.DataFrame({"High": np.where(top, self.price, np.nan),
+                                 "Low": np.where(top, np.nan, self.price)},
+                                index=self.date)
+
+        high = np.full(len(index), np.nan)
+        low = np.full(len(index), np.nan)
+        high[self.position[top]] = self.price[top]
+        low[self.position[~top]] = self.price[~top]
+        return pd.DataFrame({"High": high, "Low": low}, index=index)
+
+
+# 分型数据项
+class FractalItem:
+    __slots__ = ("position", "kind", "price", "date")
+
+    def __init__(self, position, kind, price, date):
+        self.position = position
+        self.kind = kind
+        self.price = price
+        self.date = date
+
+    # 判断是否为顶分型
+    def is_top(self):
+        return self.kind == FractalList.TOP
+
+    # 判断是否为底分型
+    def is_bottom(self):
+        return self.kind == FractalList.BOTTOM
+
+    # 顶分型的最高价，其余为空
+    def high(self):
+        return self.price if self.kind == FractalList.TOP else np.nan
+
+    # 底分型的最低价，其余为空
+    def low(self):
+        return self.price if self.kind == FractalList.BOTTOM else np.nan
+
+    # 转换为字典数据项
+    def to_dict(self):
+        return {"Date": self.date, "High": self.high(), "Low": self.low()}
+
+
 # 缠论分型类
 class Fractal(Layer):
 
@@ -16,6 +114,63 @@ class Fractal(Layer):
         if len(data) < 3:
             return fractals
 
+        # 内存中只保留真正的分型，非分型的位置保存在完整索引中（用于下一步笔的计算）
+        return self.generate_fractals(data)
+
+    # 紧凑分型列表按完整索引补齐非分型的空行（兼容原有CSV格式）
+    def _as_frame(self, data):
+        return data.to_frame(data.index) if isinstance(data, FractalList) else data
+
+    # 增量分型的初始状态（已处理的线数量，最近的两条线）
+    def _new_state(self):
+        return {"count": 0, "previous": None, "current": None}
+
+    # 增量分辨分型，每条新线确定前一条线是否为分型（不是分型的也保留位置）
+    def _scan(self, state, items):
+        fractals = []
+        for item in items:
+            previous, current = state["previous"], state["current"]
+            if previous is not None:
+                date, high, low = current
+                if high > previous[1] and high > item[1]:
+                    fractals.append(FractalItem(state["count"] - 2, FractalList.TOP, high, date))
+                elif low < previous[2] and low < item[2]:
+                    fractals.append(FractalItem(state["count"] - 2, FractalList.BOTTOM, low, date))
+                else:
+                    fractals.append(FractalItem(state["count"] - 2, FractalList.NONE, np.nan, date))
+
+            state["previous"], state["current"] = current, item
+            state["count"] += 1
+        return fractals
+
+    # 分型数据项转换为数据集
+    def _to_frame(self, items):
+        return FractalList.from_items(items).to_frame()
+
+    # 生成紧凑分型列表（位置从第二条线开始计数）
+    @staticmethod
+    def generate_fractals(data):
+        # 用错位数组一次性比较每条线和前后两条线
+        high = data["High"].to_numpy(dtype=float)
+        low = data["Low"].to_numpy(dtype=float)
+        current_high, current_low = high[1:-1], low[1:-1]
+        top = (current_high > high[:-2]) & (current_high > high[2:])
+        bottom = ~top & (current_low < low[:-2]) & (current_low < low[2:])
+
+        # 顶分型保留最高价，底分型保留最低价
+        position = np.flatnonzero(top | bottom)
+        kind = np.where(top[position], FractalList.TOP, FractalList.BOTTOM).astype(np.int8)
+        price = np.where(top[position], current_high[position], current_low[position])
+        index = data.index[1:-1]
+        return FractalList(position, kind, price, index[position], index)
+
+    # 逐行生成一个时间周期的数据（参考实现，用于校验分型结果）
+    def generate_interval_by_row(self, interval, data):
+        # 初始化分型数据集
+        fractals = pd.DataFrame(columns=["High", "Low"])
+        if len(data) < 3:
+            return fractals
+
         # 遍历线，寻找分型
         for index in range(1, len(data) - 1):
             previous = self._get_item(data, index - 1)
@@ -51,10 +206,10 @@ class Fractal(Layer):
 
 if __name__ == '__main__':
     source = Source("SQQQ")
-    source.load_from_csv()
+    source.load()
 
     stick = Stick(source)
-    stick.load_from_csv()
+    stick.load()
 
     fractal = Fractal(stick)
     fractal.generate()
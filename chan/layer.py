@@ -1,5 +1,8 @@
+import io
+import logging
 import os
 from abc import ABC, abstractmethod
+from bisect import bisect_right
 from enum import Enum
 from pathlib import Path
 from typing import Dict
@@ -7,6 +10,12 @@ from typing import Dict
 import numpy as np
 import pandas as pd
 
+from chan.metrics import measure
+from chan.storage import Storage
+from chan.summary import SummaryIndex
+
+logger = logging.getLogger("chan.layer")
+
 
 # 时间周期级别
 class Interval(Enum):
@@ -19,6 +28,82 @@ class Interval(Enum):
     MONTH_1 = "1mo"
 
 
+# 增量更新的数据：已确认的数据按批追加，不再复制；尚未确认的尾部数据每次替换，
+# 读取完整数据集时才合并（合并后的已确认数据作为一批保留，之后只追加新的批次）
+class Buffer:
+
+    def __init__(self, confirmed=None, tail=None):
+        self.chunks = []
+        self.starts = []
+        self.confirmed = 0
+        self.tail = tail if tail is not None else pd.DataFrame(columns=["High", "Low"])
+        self.frame = None
+        if confirmed is not None:
+            self.append(confirmed, self.tail)
+
+    def __len__(self):
+        return self.confirmed + len(self.tail)
+
+    # 追加新确认的数据，替换尾部数据
+    def append(self, confirmed, tail):
+        if len(confirmed) > 0:
+            self.chunks.append(confirmed)
+            self.starts.append(self.confirmed)
+            self.confirmed += len(confirmed)
+        self.tail = tail
+        self.frame = None
+
+    # 从指定位置开始的数据（已确认的数据和尾部数据），只合并用到的批次
+    def rows(self, start):
+        if start >= self.confirmed:
+            return self.tail.iloc[start - self.confirmed:]
+        index = bisect_right(self.starts, start) - 1
+        frames = [self.chunks[index].iloc[start - self.starts[index]:]] + self.chunks[index + 1:]
+        return self._concat(frames + [self.tail])
+
+    # 最后一个已确认的数据项的时间
+    def last_date(self):
+        return self.chunks[-1].index[-1] if self.chunks else None
+
+    # 完整数据集
+    def to_frame(self):
+        if self.frame is None:
+            if len(self.chunks) > 1:
+                self.chunks, self.starts = [self._concat(self.chunks)], [0]
+            self.frame = self._concat(self.chunks + [self.tail])
+        return self.frame
+
+    # 合并非空的数据集（都为空时返回最后一个）
+    @staticmethod
+    def _concat(frames):
+        filled = [frame for frame in frames if len(frame) > 0]
+        if len(filled) == 1:
+            return filled[0]
+        return pd.concat(filled) if filled else frames[-1]
+
+
+# 各周期的数据（增量更新的周期保存为Buffer，读取时才合并为数据集）
+class LayerData(dict):
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        return value.to_frame() if isinstance(value, Buffer) else value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    # 增量更新的数据（不是增量更新的周期为None）
+    def buffer(self, key):
+        value = super().get(key)
+        return value if isinstance(value, Buffer) else None
+
+
 # 抽象层基类
 class Layer(ABC):
 
@@ -32,49 +117,177 @@ class Layer(ABC):
 
         self.path = Path(__file__).parent.parent / "data" / self.symbol
         self.name = self.__class__.__name__.lower()
+        self.storage = Storage.default()
 
-        self.data: Dict[str, pd.DataFrame | None] = {interval.value: None for interval in Interval}
+        self.data: Dict[str, pd.DataFrame | None] = LayerData({interval.value: None for interval in Interval})
 
-    # 生成数据
-    def generate(self, auto_save=True):
-        for interval in Interval:
-            self.data[interval.value] = self.generate_interval(interval, self.parent.data[interval.value])
+        # 增量更新状态（扫描状态、已确认的行数、已处理的上一层行数）
+        self.streams: Dict[str, dict | None] = {interval.value: None for interval in Interval}
+
+    # 生成数据（可以只生成指定的时间周期）
+    def generate(self, auto_save=True, intervals=Interval):
+        for interval in intervals:
+            self.data[interval.value] = self._generate(interval, self.parent.data[interval.value])
+            self.streams[interval.value] = None
         if auto_save:
             self.save()
 
+    # 生成一个时间周期的数据，记录耗时和输入输出的行数
+    def _generate(self, interval, data, operation="generate"):
+        with measure(self.name, interval.value, operation, self._rows(data)) as sample:
+            result = self.generate_interval(interval, data)
+            sample.rows_out = self._rows(result)
+        return result
+
+    # 数据集的行数（没有数据时为0）
+    @staticmethod
+    def _rows(data):
+        return len(data) if data is not None else 0
+
     # 生成一个时间周期的数据
     @abstractmethod
     def generate_interval(self, interval, data):
         pass
 
-    # 保存数据到CSV文件
+    # 增量更新一个时间周期的数据（上一层更新后调用），返回新确认的数据和尚未确认的尾部数据
+    def update(self, interval):
+        stream = self.streams[interval.value]
+        if stream is None:
+            stream = {"state": self._new_state(), "confirmed": 0, "consumed": 0}
+            self.streams[interval.value] = stream
+
+        # 上一层新确认的数据接着已确认的状态处理（只取上一次处理之后的数据）
+        consumed, count = stream["consumed"], self.parent.get_confirmed(interval)
+        parent = self.parent.get_rows(interval, consumed)
+        items = self._scan(stream["state"], self._items(parent.iloc[:count - consumed], consumed))
+        stream["consumed"] = count
+
+        # 上一层尚未确认的数据只在状态副本上处理
+        state = self._copy_state(stream["state"])
+        tail = self._scan(state, self._items(parent.iloc[count - consumed:], count)) + self._finish(state)
+
+        confirmed, tail = self._to_frame(items), self._to_frame(tail)
+        self._append(interval, confirmed, tail)
+        return confirmed, tail
+
+    # 获取指定周期已确认（不会再变化）的行数
+    def get_confirmed(self, interval):
+        stream = self.streams[interval.value]
+        return stream["confirmed"] if stream is not None else 0
+
+    # 增量更新的初始状态
+    def _new_state(self):
+        return {}
+
+    # 复制增量更新的状态（处理尾部数据用），状态中的数据项不会被修改，只复制列表
+    @staticmethod
+    def _copy_state(state):
+        return {key: list(value) if isinstance(value, list) else value for key, value in state.items()}
+
+    # 增量处理数据项，返回已经确定的输出数据项
+    def _scan(self, state, items):
+        return []
+
+    # 输入结束，返回剩余的输出数据项
+    def _finish(self, state):
+        return []
+
+    # 从上一层的数据集获取数据项（时间、最高价、最低价），位置从start开始计数
+    def _items(self, data, start):
+        return list(zip(data.index, data["High"].tolist(), data["Low"].tolist()))
+
+    # 数据项转换为数据集
+    def _to_frame(self, items):
+        if len(items) == 0:
+            return pd.DataFrame(columns=["High", "Low"])
+        dates, highs, lows = zip(*items)
+        return pd.DataFrame({"High": highs, "Low": lows}, index=pd.Index(dates))
+
+    # 把新确认的数据和尾部数据接到已确认的数据后面（已确认的数据不再复制）
+    def _append(self, interval, confirmed, tail):
+        stream = self.streams[interval.value]
+        buffer = self.data.buffer(interval.value)
+        if buffer is None or buffer.confirmed != stream["confirmed"]:
+            data = self.get_frame(interval)
+            buffer = Buffer(data.iloc[:stream["confirmed"]] if stream["confirmed"] > 0 else None)
+            self.data[interval.value] = buffer
+        buffer.append(confirmed, tail)
+        stream["confirmed"] += len(confirmed)
+
+    # 保存数据，同时更新最新状态汇总表
     def save(self):
+        self._save(self.storage)
+        SummaryIndex.shared().update(self)
+
+    # 导出数据到CSV文件
+    def export_csv(self):
+        self._save(Storage.CSV)
+
+    # 加载数据（可以只加载指定的时间周期）
+    def load(self, intervals=Interval):
+        self._load(self.storage, intervals)
+
+    # 从CSV文件加载数据（可以只加载指定的时间周期）
+    def load_from_csv(self, intervals=Interval):
+        self._load(Storage.CSV, intervals)
+
+    def _save(self, storage):
         os.makedirs(self.path, exist_ok=True)
         for interval in Interval:
-            data = self.get_data(interval)
+            data = self.get_frame(interval)
             if data is not None:
-                data.to_csv(self._file_name(interval), index_label='Date')
+                file_name = self.get_file_name(interval, storage)
+                with measure(self.name, interval.value, "save", len(data)) as sample:
+                    storage.write(data, file_name)
+                    sample.bytes = os.path.getsize(file_name)
 
-    # 从CSV文件加载数据
-    def load_from_csv(self):
-        for interval in Interval:
-            file_name = self._file_name(interval)
+    def _load(self, storage, intervals=Interval):
+        for interval in intervals:
+            file_name = self.get_file_name(interval, storage)
             if os.path.exists(file_name):
                 try:
-                    data = pd.read_csv(file_name, index_col=0, parse_dates=True)
-                    self.data[interval.value] = data
+                    self.data[interval.value] = self._read(storage, interval, file_name)
                 except Exception as e:
-                    print(f"Error loading {file_name}: {e}")
+                    logger.error(f"Error loading {file_name}: {e}")
             else:
-                print(f"File {file_name} does not exist.")
+                logger.warning(f"File {file_name} does not exist.")
+
+    # 读取一个数据文件，分别记录读文件和解析的耗时
+    def _read(self, storage, interval, file_name):
+        with measure(self.name, interval.value, "read") as sample:
+            with open(file_name, "rb") as file:
+                content = file.read()
+            sample.bytes = len(content)
+        with measure(self.name, interval.value, "parse") as sample:
+            data = storage.read(io.BytesIO(content))
+            sample.bytes = len(content)
+            sample.rows_out = len(data)
+        return data
 
     # 获取指定周期的数据
     def get_data(self, interval):
         return self.data.get(interval.value)
 
+    # 获取指定周期的数据集（保存文件和接口输出使用，内存中不是数据集的层在这里转换）
+    def get_frame(self, interval):
+        return self._as_frame(self.get_data(interval))
+
+    # 内存中的数据转换为数据集
+    def _as_frame(self, data):
+        return data
+
+    # 获取指定周期从指定位置开始的数据（增量更新时不合并完整数据集）
+    def get_rows(self, interval, start):
+        buffer = self.data.buffer(interval.value)
+        if buffer is not None:
+            return buffer.rows(start)
+        data = self.get_frame(interval)
+        return data.iloc[start:] if data is not None else None
+
     # 生成文件名
-    def _file_name(self, interval):
-        return f'{self.path}/{self.name}_{interval.value}.csv'
+    def get_file_name(self, interval, storage=None):
+        storage = storage or self.storage
+        return f'{self.path}/{self.name}_{interval.value}.{storage.value}'
 
     # 获取数据项
     @staticmethod
@@ -89,11 +302,6 @@ class Layer(ABC):
         else:
             data.loc[item.name] = item
 
-    # 删除数据项
-    @staticmethod
-    def _drop_item(data, item):
-        data.drop(item.name, inplace=True)
-
     # 判断是否为顶分型
     @staticmethod
     def _is_top(item):
@@ -0,0 +1,14 @@
+import numpy as np
+
+
+# 柱状图的红柱、绿柱前缀和（第一个为起始值，绿柱为负数），接着起始值按顺序累加，分批计算和一次计算的结果相同
+def prefix(histogram, red=0.0, green=0.0):
+    values = np.nan_to_num(np.asarray(histogram, dtype=float))
+    return (np.cumsum(np.concatenate([[red], np.maximum(values, 0.0)])),
+            np.cumsum(np.concatenate([[green], np.minimum(values, 0.0)])))
+
+
+# 以每个端点为终点的笔或线段的MACD面积（起点之后到终点的K线，向上取红柱面积，向下取绿柱面积），第一个端点没有面积
+#   red、green为到每个端点K线为止（包含端点K线）的前缀和，top为终点是否为顶分型
+def areas(top, red, green):
+    return np.concatenate([[np.nan], np.where(top[1:], red[1:] - red[:-1], green[:-1] - green[1:])])
@@ -0,0 +1,141 @@
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger("chan.metrics")
+
+
+# 一次测量的结果（层、周期、操作、耗时、输入输出行数、读写字节数、峰值内存）
+class Sample:
+    __slots__ = ("layer", "interval", "operation", "seconds", "rows_in", "rows_out", "bytes", "peak_bytes", "error")
+
+    def __init__(self, layer, interval, operation, rows_in=0):
+        self.layer = layer
+        self.interval = interval
+        self.operation = operation
+        self.seconds = 0.0
+        self.rows_in = rows_in
+        self.rows_out = 0
+        self.bytes = 0
+        self.peak_bytes = None
+        self.error = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# 按(层, 周期, 操作)累计的测量结果，可以导出为Prometheus文本格式
+class Registry:
+
+    # 导出的指标（指标名、累计的字段、说明）
+    METRICS = [("chan_layer_calls_total", None, "Number of layer operations"),
+               ("chan_layer_errors_total", "errors", "Number of failed layer operations"),
+               ("chan_layer_seconds_total", "seconds", "Time spent in layer operations"),
+               ("chan_layer_rows_in_total", "rows_in", "Rows read from the parent layer"),
+               ("chan_layer_rows_out_total", "rows_out", "Rows produced"),
+               ("chan_layer_bytes_total", "bytes", "Bytes read or written")]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.peaks = {}
+
+    def record(self, sample):
+        key = (sample.layer, sample.interval, sample.operation)
+        with self.lock:
+            totals = self.totals.setdefault(key, {"calls": 0, "errors": 0, "seconds": 0.0,
+                                                  "rows_in": 0, "rows_out": 0, "bytes": 0})
+            totals["calls"] += 1
+            totals["errors"] += sample.error is not None
+            totals["seconds"] += sample.seconds
+            totals["rows_in"] += sample.rows_in
+            totals["rows_out"] += sample.rows_out
+            totals["bytes"] += sample.bytes
+            if sample.peak_bytes is not None:
+                self.peaks[key] = max(self.peaks.get(key, 0), sample.peak_bytes)
+
+    def clear(self):
+        with self.lock:
+            self.totals.clear()
+            self.peaks.clear()
+
+    # 导出为Prometheus文本格式，gauges为额外的即时指标（名称: 数值）
+    def render(self, gauges=None):
+        with self.lock:
+            totals = dict(self.totals)
+            peaks = dict(self.peaks)
+
+        lines = []
+        for name, field, description in self.METRICS:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for key, values in sorted(totals.items()):
+                lines.append(f"{name}{self._labels(key)} {values[field or 'calls']}")
+        if peaks:
+            lines.append("# HELP chan_layer_peak_bytes Peak traced memory of a layer operation")
+            lines.append("# TYPE chan_layer_peak_bytes gauge")
+            for key, value in sorted(peaks.items()):
+                lines.append(f"chan_layer_peak_bytes{self._labels(key)} {value}")
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(key):
+        layer, interval, operation = key
+        return f'{{layer="{layer}",interval="{interval}",operation="{operation}"}}'
+
+
+registry = Registry()
+local = threading.local()
+
+
+# 测量一次层操作：记录耗时并输出结构化日志，调用方在返回的Sample上填写行数和字节数
+# 环境变量CHAN_PROFILE=cprofile保存cProfile结果，CHAN_PROFILE=tracemalloc记录峰值内存（只在最外层测量）
+@contextmanager
+def measure(layer, interval, operation, rows_in=0):
+    sample = Sample(layer, interval, operation, rows_in)
+    outermost = not getattr(local, "active", False)
+    profile = os.environ.get("CHAN_PROFILE", "") if outermost else ""
+    profiler = cProfile.Profile() if profile == "cprofile" else None
+    tracing = profile == "tracemalloc" and not tracemalloc.is_tracing()
+
+    local.active = True
+    if tracing:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield sample
+    except Exception as e:
+        sample.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sample.seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            _dump(profiler, sample)
+        if tracing:
+            sample.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        local.active = not outermost
+        registry.record(sample)
+        logger.info(json.dumps(sample.to_dict()))
+
+
+# 保存cProfile结果到data/profiles目录
+def _dump(profiler, sample):
+    folder = Path(__file__).parent.parent / "data" / "profiles"
+    os.makedirs(folder, exist_ok=True)
+    file_name = folder / f"{sample.layer}_{sample.interval}_{sample.operation}_{time.time_ns()}.prof"
+    profiler.dump_stats(file_name)
+    logger.info(json.dumps({"profile": str(file_name), "layer": sample.layer,
+                            "interval": sample.interval, "operation": sample.operation}))
@@ -0,0 +1,101 @@
+from chan.fractal import Fractal, FractalList
+from chan.layer import Interval
+from chan.metrics import measure
+from chan.pivot import StrokePivot, SegmentPivot
+from chan.segment import Segment
+from chan.source import Source
+from chan.stick import Stick
+from chan.stroke import Stroke
+
+
+# 融合流水线：从数据源开始逐批处理K线，每一层新确定的数据项直接交给下一层，
+# 只有需要保留的层才生成数据集（默认只保留笔、线段和中枢）
+class Pipeline:
+
+    # 默认保留的层
+    FINAL = ("stroke", "strokepivot", "segment", "segmentpivot")
+
+    def __init__(self, source, keep=FINAL, batch=10000):
+        self.source = source if isinstance(source, Source) else Source(source)
+        self.name = self.__class__.__name__.lower()
+        self.stick = Stick(self.source)
+        self.fractal = Fractal(self.stick)
+        self.stroke = Stroke(self.fractal)
+        self.strokePivot = StrokePivot(self.stroke)
+        self.segment = Segment(self.stroke)
+        self.segmentPivot = SegmentPivot(self.segment)
+        self.layers = [self.stick, self.fractal, self.stroke, self.strokePivot, self.segment, self.segmentPivot]
+
+        self.keep = keep
+        self.batch = batch
+
+    # 生成数据（可以只生成指定的时间周期），只保存保留的层
+    def generate(self, auto_save=True, intervals=Interval):
+        for interval in intervals:
+            data = self.source.get_data(interval)
+            with measure(self.name, interval.value, "generate", len(data) if data is not None else 0) as sample:
+                self.generate_interval(interval, data)
+                sample.rows_out = sum(len(layer.get_data(interval)) for layer in self.layers
+                                      if layer.name in self.keep)
+        if auto_save:
+            for layer in self.layers:
+                if layer.name in self.keep:
+                    layer.save()
+
+    # 生成一个时间周期的数据
+    def generate_interval(self, interval, data):
+        states = {layer.name: layer._new_state() for layer in self.layers}
+        outputs = {layer.name: [] for layer in self.layers if layer.name in self.keep}
+
+        # 数据提供者没有数据时返回没有列的空数据集，这时各层都是空数据集（和逐层生成一致）
+        if data is not None and not data.empty and "High" in data.columns and "Low" in data.columns:
+            for batch in self._batches(data):
+                self._push(states, outputs, batch, False)
+        self._push(states, outputs, [], True)
+
+        for layer in self.layers:
+            layer.streams[interval.value] = None
+            if layer.name in outputs:
+                frame = layer._to_frame(outputs[layer.name])
+                # 数据项中用的是数据源的行号，最后换回时间
+                if len(frame) > 0:
+                    frame.index = data.index[frame.index.to_numpy(dtype=int)]
+                layer.data[interval.value] = frame
+
+    # 逐批获取数据源的数据项（行号、最高价、最低价），用行号代替时间，避免逐行生成时间对象
+    def _batches(self, data):
+        high = data["High"].to_numpy(dtype=float)
+        low = data["Low"].to_numpy(dtype=float)
+        for start in range(0, len(data), self.batch):
+            end = min(start + self.batch, len(data))
+            yield list(zip(range(start, end), high[start:end].tolist(), low[start:end].tolist()))
+
+    # 一批数据项依次经过各层（笔的结果同时交给笔中枢和线段）
+    def _push(self, states, outputs, items, final):
+        sticks = self._step(self.stick, states, outputs, items, final)
+        fractals = self._step(self.fractal, states, outputs, sticks, final)
+        # 笔只处理真正的分型
+        fractals = [item for item in fractals if item.kind != FractalList.NONE]
+        strokes = self._step(self.stroke, states, outputs, fractals, final)
+        self._step(self.strokePivot, states, outputs, strokes, final)
+        segments = self._step(self.segment, states, outputs, strokes, final)
+        self._step(self.segmentPivot, states, outputs, segments, final)
+
+    # 一层处理一批数据项，输入结束时加上剩余的数据项，保留的层记录输出
+    @staticmethod
+    def _step(layer, states, outputs, items, final):
+        state = states[layer.name]
+        result = layer._scan(state, items) if len(items) > 0 else []
+        if final:
+            result = result + layer._finish(state)
+        if layer.name in outputs:
+            outputs[layer.name].extend(result)
+        return result
+
+
+if __name__ == '__main__':
+    source = Source("SQQQ")
+    source.load()
+
+    pipeline = Pipeline(source)
+    pipeline.generate()
@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 
-from chan.fractal import Fractal
+from chan.fractal import Fractal, FractalList
 from chan.layer import Layer
 from chan.segment import Segment
 from chan.source import Source
@@ -8,122 +9,278 @@ from chan.stick import Stick
 from chan.stroke import Stroke
 
 
+# 紧凑中枢表（起点时间、终点时间、最低价、最高价、方向、包含的笔或线段数量的平行数组）
+class PivotTable:
+    __slots__ = ("start", "end", "low", "high", "direction", "count")
+
+    # 中枢方向（进入中枢的笔或线段向上时起点为顶分型）
+    UP = 1
+    DOWN = -1
+
+    def __init__(self, start, end, low, high, direction, count):
+        self.start = start
+        self.end = end
+        self.low = low
+        self.high = high
+        self.direction = direction
+        self.count = count
+
+    def __len__(self):
+        return len(self.start)
+
+    # 从中枢端点数据集转换（每个中枢两行），指定笔或线段数据集时计算包含的数量
+    @classmethod
+    def from_frame(cls, data, parent=None):
+        count = len(data) // 2 * 2
+        high = data["High"].to_numpy(dtype=float)[:count].reshape(-1, 2)
+        low = data["Low"].to_numpy(dtype=float)[:count].reshape(-1, 2)
+        up = ~np.isnan(high[:, 0])
+        start, end = data.index[0:count:2], data.index[1:count:2]
+        if parent is not None:
+            strokes = parent.index.get_indexer(end) - parent.index.get_indexer(start)
+        else:
+            strokes = np.full(len(start), -1)
+        return cls(start, end,
+                   np.where(up, low[:, 1], low[:, 0]), np.where(up, high[:, 0], high[:, 1]),
+                   np.where(up, cls.UP, cls.DOWN).astype(np.int8), strokes)
+
+    # 转换为中枢端点数据集（起点为顶分型时起点保留最高价、终点保留最低价，反之亦然，兼容原有CSV格式）
+    def to_frame(self):
+        if len(self) == 0:
+            return pd.DataFrame(columns=["High", "Low"])
+        up = self.direction == self.UP
+        high = np.full(len(self) * 2, np.nan)
+        low = np.full(len(self) * 2, np.nan)
+        high[0::2] = np.where(up, self.high, np.nan)
+        low[1::2] = np.where(up, self.low, np.nan)
+        low[0::2] = np.where(up, np.nan, self.low)
+        high[1::2] = np.where(up, np.nan, self.high)
+        index = self.start.append(self.end)[np.arange(len(self) * 2).reshape(2, -1).T.ravel()]
+        return pd.DataFrame({"High": high, "Low": low}, index=index)
+
+    # 转换为中枢表数据集
+    def to_table(self):
+        return pd.DataFrame({"Start": self.start, "End": self.end,
+                             "Low": self.low, "High": self.high,
+                             "Direction": self.direction, "Count": self.count})
+
+
 # 缠论中枢类
 class Pivot(Layer):
 
     # 生成一个时间周期的数据（构建中枢）
     def generate_interval(self, interval, data):
-        # 初始化空的中枢数据集
+        # 笔或线段的端点都是分型
+        return self.generate_pivots(FractalList.of(data)).to_frame()
+
+    # 逐行生成一个时间周期的数据（参考实现，用于校验中枢结果）
+    def generate_interval_by_row(self, interval, data):
+        # 初始化中枢数据集
         pivots = pd.DataFrame(columns=["High", "Low"])
         if len(data) < 5:
             return pivots
 
-        # 遍历线段，寻找中枢
+        # 遍历笔或线段，寻找中枢
         index = 0
         while index < len(data) - 5:
-            current = self._get_item(data, index)
-            first = self._get_item(data, index + 1)
-            second = self._get_item(data, index + 2)
-            third = self._get_item(data, index + 3)
-            fourth = self._get_item(data, index + 4).copy()
-
-            # 计算中枢区间
-            previous_range = self._get_range(current, first)
-            first_range = self._get_range(first, second)
-            second_range = self._get_range(third, fourth)
-            pivot = self._get_cross_range(first_range, second_range)
-
-            # 判断中枢是否成立
-            if self._cross_range(pivot, previous_range) and self._cross_range(first_range, second_range):
-                # 中枢扩展
-                suffix = 0
-                while index + suffix < len(data) - 7:
-                    fifth = self._get_item(data, index + suffix + 5)
-                    sixth = self._get_item(data, index + suffix + 6)
-                    next_range = self._get_range(fifth, sixth)
-                    # 离开中枢区间，则结束
-                    if self._out_of_range(pivot, next_range):
-                        break
-                    suffix += 2
-
-                # 保存中枢
-                last = self._get_item(data, index + suffix + 4).copy()
-                after = self._get_item(data, index + suffix + 5)
-                if self._on_direction(pivot, after):
-                    if self._is_top(first):
-                        first["High"] = pivot["high"]
-                        last["Low"] = pivot["low"]
-                    else:
-                        first["Low"] = pivot["low"]
-                        last["High"] = pivot["high"]
-
-                    self._keep_item(pivots, first)
-                    self._keep_item(pivots, last)
-                    index += suffix + 4
-                else:
-                    index += 1
-            else:
-                # 中枢不成立
+            current, first, second, third, fourth = (self._get_item(data, index + offset) for offset in range(5))
+
+            # 中枢区间为第一段和第三段的重叠部分，前一段和中枢区间重叠、第一段和第三段重叠时中枢成立
+            previous_high, previous_low = self._get_range(current, first)
+            first_high, first_low = self._get_range(first, second)
+            second_high, second_low = self._get_range(third, fourth)
+            high, low = min(first_high, second_high), max(first_low, second_low)
+            if not (previous_high > low and previous_low < high
+                    and second_high > first_low and second_low < first_high):
                 index += 1
+                continue
 
-        # 合并中枢
+            # 中枢扩展，直到离开中枢区间
+            suffix = 0
+            while index + suffix < len(data) - 7:
+                next_high, next_low = self._get_range(self._get_item(data, index + suffix + 5),
+                                                      self._get_item(data, index + suffix + 6))
+                if (next_high < low or next_high > high) and (next_low < low or next_low > high):
+                    break
+                suffix += 2
+
+            # 离开中枢的方向和进入中枢的方向一致，则保存中枢的起点、终点
+            after = self._get_item(data, index + suffix + 5)
+            if not (self._is_top(after) and after["High"] > high or self._is_bottom(after) and after["Low"] < low):
+                index += 1
+                continue
+            first, last = first.copy(), self._get_item(data, index + suffix + 4).copy()
+            if self._is_top(first):
+                first["High"], last["Low"] = high, low
+            else:
+                first["Low"], last["High"] = low, high
+            self._keep_item(pivots, first)
+            self._keep_item(pivots, last)
+            index += suffix + 4
+
+        # 同方向且有重叠的相邻中枢合并（保留前一个中枢的起点和后一个中枢的终点）
         index = 0
         while index < len(pivots) - 3:
-            current = self._get_item(pivots, index)
-            first = self._get_item(pivots, index + 1)
-            first_pivot = self._get_range(current, first)
-
-            second = self._get_item(pivots, index + 2)
-            third = self._get_item(pivots, index + 3)
-            second_pivot = self._get_range(second, third)
-
-            # 中枢同方向，且有重叠，则合并中枢
-            if self._cross_range(first_pivot, second_pivot):
-                if self._is_top(current) and self._is_top(second):
-                    current["High"] = max(current["High"], second["High"])
-                    third["Low"] = min(first["Low"], third["Low"])
-                    self._drop_item(pivots, first)
-                    self._drop_item(pivots, second)
-                elif self._is_bottom(current) and self._is_bottom(second):
-                    current["Low"] = min(current["Low"], second["Low"])
-                    third["High"] = max(first["High"], third["High"])
-                    self._drop_item(pivots, first)
-                    self._drop_item(pivots, second)
-                else:
-                    index += 2
+            current, first, second, third = (self._get_item(pivots, index + offset) for offset in range(4))
+            first_high, first_low = self._get_range(current, first)
+            second_high, second_low = self._get_range(second, third)
+            if (second_high > first_low and second_low < first_high
+                    and self._is_top(current) == self._is_top(second)):
+                pivots.drop([first.name, second.name], inplace=True)
             else:
                 index += 2
 
         return pivots
 
-    # 计算中枢区间
+    # 相邻两个端点的区间（最高价、最低价）
     def _get_range(self, current, last):
         high = current["High"] if self._is_top(current) else last["High"]
         low = current["Low"] if self._is_bottom(current) else last["Low"]
-        return {"high": high, "low": low}
+        return high, low
+
+    # 获取指定周期的中枢表（笔或线段数据没有加载时不计算包含的数量）
+    def get_table(self, interval):
+        return PivotTable.from_frame(self.get_data(interval), self.parent.get_data(interval))
 
-    # 中枢重叠
+    # 一次遍历端点构建中枢（结果为紧凑中枢表）
     @staticmethod
-    def _cross_range(first_range, second_range):
-        return (second_range["high"] > first_range["low"]
-                and second_range["low"] < first_range["high"])
+    def generate_pivots(fractals):
+        pivots, _ = Pivot._find_pivots(fractals.kind, fractals.price, True)
+        start = np.array([pivot[0] for pivot in pivots], dtype=np.intp)
+        end = np.array([pivot[1] for pivot in pivots], dtype=np.intp)
+        return PivotTable(fractals.date[start], fractals.date[end],
+                          np.array([pivot[2] for pivot in pivots], dtype=float),
+                          np.array([pivot[3] for pivot in pivots], dtype=float),
+                          np.array([pivot[4] for pivot in pivots], dtype=np.int8), end - start)
 
-    # 离开中枢
+    # 在端点数组上寻找中枢：先批量计算相邻端点的区间和中枢成立条件，
+    # 再从每个成立的位置向后扩展，同方向重叠的中枢在生成时直接合并。
+    # 中枢（起点位置、终点位置、最低价、最高价、方向）追加到pivots（可以带着之前还可能合并的中枢），
+    # 返回中枢和下一次开始寻找的位置，输入还没有结束时（final为False），中枢扩展到数据末尾就停下等待后续数据
     @staticmethod
-    def _out_of_range(first_range, second_range):
-        return ((second_range["high"] < first_range["low"]
-                 or second_range["high"] > first_range["high"])
-                and (second_range["low"] < first_range["low"]
-                     or second_range["low"] > first_range["high"]))
+    def _find_pivots(kind, price, final, pivots=None):
+        size = len(kind)
+        pivots = [] if pivots is None else pivots
+        if size < 6:
+            return pivots, 0
 
+        # 顶分型只有最高价，底分型只有最低价
+        top, bottom = kind == FractalList.TOP, kind == FractalList.BOTTOM
+        high = np.where(top, price, np.nan)
+        low = np.where(bottom, price, np.nan)
+
+        # 相邻两个端点的区间
+        range_high = np.where(top[:-1], high[:-1], high[1:])
+        range_low = np.where(bottom[:-1], low[:-1], low[1:])
+
+        # 每个位置的中枢区间和中枢是否成立（前一段与中枢区间重叠，第一段与第三段重叠）
+        count = size - 5
+        first_high, first_low = range_high[1:count + 1], range_low[1:count + 1]
+        second_high, second_low = range_high[3:count + 3], range_low[3:count + 3]
+        pivot_high = np.where(second_high < first_high, second_high, first_high)
+        pivot_low = np.where(second_low > first_low, second_low, first_low)
+        valid = ((range_high[:count] > pivot_low) & (range_low[:count] < pivot_high)
+                 & (second_high > first_low) & (second_low < first_high))
+        candidates = np.flatnonzero(valid)
+
+        range_high, range_low = range_high.tolist(), range_low.tolist()
+        high, low, kind = high.tolist(), low.tolist(), kind.tolist()
+        index, cursor = 0, 0
+        while True:
+            # 跳到下一个中枢成立的位置，没有时之前的位置都不会再构成中枢
+            while cursor < len(candidates) and candidates[cursor] < index:
+                cursor += 1
+            if cursor == len(candidates):
+                return pivots, max(index, count)
+            index = int(candidates[cursor])
+            pivot_high_value, pivot_low_value = float(pivot_high[index]), float(pivot_low[index])
+
+            # 中枢扩展，直到离开中枢区间
+            suffix = 0
+            while index + suffix < size - 7:
+                next_high, next_low = range_high[index + suffix + 5], range_low[index + suffix + 5]
+                if ((next_high < pivot_low_value or next_high > pivot_high_value)
+                        and (next_low < pivot_low_value or next_low > pivot_high_value)):
+                    break
+                suffix += 2
+            else:
+                # 中枢还可能继续扩展，等待后续数据
+                if not final:
+                    return pivots, index
+
+            # 离开中枢的方向和进入中枢的方向一致，则中枢成立
+            after = index + suffix + 5
+            if kind[after] == FractalList.TOP and high[after] > pivot_high_value \
+                    or kind[after] == FractalList.BOTTOM and low[after] < pivot_low_value:
+                Pivot._append_pivot(pivots, [index + 1, index + suffix + 4,
+                                             pivot_low_value, pivot_high_value, kind[index + 1]])
+                index += suffix + 4
+            else:
+                index += 1
+
+    # 保存中枢，和上一个中枢同方向且有重叠时合并
+    # （合并后起点一侧的价格来自前一个中枢，终点一侧的价格来自后一个中枢，与原有结果一致）
     @staticmethod
-    def _get_cross_range(first_range, second_range):
-        return {"high": min(first_range["high"], second_range["high"]),
-                "low": max(first_range["low"], second_range["low"])}
+    def _append_pivot(pivots, pivot):
+        if pivots:
+            last = pivots[-1]
+            if last[4] == pivot[4] and pivot[3] > last[2] and pivot[2] < last[3]:
+                if last[4] == FractalList.TOP:
+                    last[2] = pivot[2]
+                else:
+                    last[3] = pivot[3]
+                last[1] = pivot[1]
+                return
+        pivots.append(pivot)
+
+    # 增量构建中枢的初始状态（还没有处理完的端点、还可能和后面的中枢合并的最后一个中枢）
+    def _new_state(self):
+        return {"fractals": [], "pivots": []}
+
+    # 复制状态（最后一个中枢合并时会被修改，也要复制）
+    @staticmethod
+    def _copy_state(state):
+        return {"fractals": list(state["fractals"]), "pivots": [list(pivot) for pivot in state["pivots"]]}
+
+    # 增量构建中枢（增量更新和融合流水线使用，和generate_pivots使用同一个引擎），返回不会再变化的中枢
+    def _scan(self, state, items):
+        state["fractals"].extend(items)
+        return self._settle(state, False)
+
+    # 输入结束，返回剩余的中枢
+    def _finish(self, state):
+        return self._settle(state, True)
+
+    # 在还没有处理完的端点上寻找中枢，中枢的起点、终点保存为分型数据项，
+    # 和最后一个中枢合并后，除最后一个中枢以外的都不会再变化（输入结束时全部确定）
+    def _settle(self, state, final):
+        fractals = state["fractals"]
+        pivots, index = self._find_pivots(np.array([item.kind for item in fractals], dtype=np.int8),
+                                          np.array([item.price for item in fractals], dtype=float),
+                                          final, state["pivots"])
+        # 新找到的中枢的起点、终点位置换成分型数据项
+        for pivot in pivots:
+            for side in (0, 1):
+                if isinstance(pivot[side], int):
+                    pivot[side] = fractals[pivot[side]]
+        del fractals[:index]
+
+        settled = pivots if final else pivots[:-1]
+        state["pivots"] = [] if final else pivots[-1:]
+        return settled
+
+    # 从笔或线段数据集获取分型数据项
+    def _items(self, data, start):
+        return FractalList.from_frame(data, start).items()
 
-    def _on_direction(self, pivot, after):
-        return (self._is_top(after) and after["High"] > pivot["high"]
-                or self._is_bottom(after) and after["Low"] < pivot["low"])
+    # 中枢转换为中枢端点数据集
+    def _to_frame(self, items):
+        return PivotTable(pd.Index([item[0].date for item in items]), pd.Index([item[1].date for item in items]),
+                          np.array([item[2] for item in items], dtype=float),
+                          np.array([item[3] for item in items], dtype=float),
+                          np.array([item[4] for item in items], dtype=np.int8),
+                          np.array([item[1].position - item[0].position for item in items], dtype=np.intp)
+                          ).to_frame()
 
 
 class StrokePivot(Pivot):
@@ -136,22 +293,22 @@ class SegmentPivot(Pivot):
 
 if __name__ == '__main__':
     source = Source("000001.SS")
-    source.load_from_csv()
+    source.load()
 
     stick = Stick(source)
-    stick.load_from_csv()
+    stick.load()
 
     fractal = Fractal(stick)
-    fractal.load_from_csv()
+    fractal.load()
 
     stroke = Stroke(fractal)
-    stroke.load_from_csv()
+    stroke.load()
 
     strokePivot = StrokePivot(stroke)
     strokePivot.generate()
 
     segment = Segment(stroke)
-    segment.load_from_csv()
+    segment.load()
 
     segmentPivot = SegmentPivot(segment)
     segmentPivot.generate()
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import pandas as pd
+import yfinance as yf
+
+from chan.layer import Interval
+from chan.storage import Storage
+
+
+# K线数据提供者基类
+class Provider(ABC):
+
+    # 当前部署使用的数据提供者（环境变量CHAN_PROVIDER，默认Yahoo财经，也可以是本地目录或文件）
+    @staticmethod
+    def default():
+        location = os.environ.get("CHAN_PROVIDER", "yahoo")
+        if location == "yahoo":
+            return YahooProvider()
+        return FileProvider(location)
+
+    # 获取一个股票一个时间周期的K线，可以指定时间范围（period）或开始时间（start）
+    @abstractmethod
+    def history(self, symbol, interval, period=None, start=None):
+        pass
+
+    # 预先读取数据（多进程下载前在主进程调用，子进程可以直接使用）
+    def preload(self):
+        pass
+
+    # 按时间范围或开始时间截取K线，时间范围从最后一条K线往前计算
+    @staticmethod
+    def _slice(df, period=None, start=None):
+        if df.empty:
+            return df
+        if start is not None:
+            start = pd.Timestamp(start)
+            if start.tz is None and df.index.tz is not None:
+                start = start.tz_localize(df.index.tz)
+            elif start.tz is not None and df.index.tz is None:
+                start = start.tz_convert(None)
+            df = df[df.index >= start]
+        elif period is not None and period != "max":
+            df = df[df.index > df.index[-1] - Provider._offset(period)]
+        return df.copy()
+
+    # 时间范围转换为时间偏移（如5d、1mo、10y）
+    @staticmethod
+    def _offset(period):
+        if period.endswith("mo"):
+            return pd.DateOffset(months=int(period[:-2]))
+        if period.endswith("y"):
+            return pd.DateOffset(years=int(period[:-1]))
+        return pd.DateOffset(days=int(period[:-1]))
+
+
+# Yahoo财经数据提供者
+class YahooProvider(Provider):
+
+    def history(self, symbol, interval, period=None, start=None):
+        ticker = yf.Ticker(symbol)
+        return ticker.history(
+            period=period,
+            start=start,
+            interval=interval.value,
+            actions=False
+        )
+
+
+# 已读取的大文件（按文件名和修改时间缓存，同一进程中的所有FileProvider共用，文件更新后重新读取）
+_bulk_frames = {}
+_bulk_lock = threading.Lock()
+
+
+# 本地文件数据提供者，可以是目录（每个文件一个股票一个周期，如SQQQ_1d.csv），
+# 也可以是一个包含Symbol列的大文件，一次读取所有股票（没有Interval列时都是日线）
+class FileProvider(Provider):
+
+    def __init__(self, location):
+        self.location = location
+
+    def history(self, symbol, interval, period=None, start=None):
+        if os.path.isdir(self.location):
+            df = self._read_file(symbol, interval)
+        else:
+            df = self._read_bulk().get((symbol, interval.value))
+        if df is None:
+            return pd.DataFrame()
+        return self._slice(df, period, start)
+
+    def preload(self):
+        if not os.path.isdir(self.location):
+            self._read_bulk()
+
+    # 读取目录中一个股票一个周期的文件
+    def _read_file(self, symbol, interval):
+        for storage in Storage:
+            file_name = os.path.join(self.location, f"{symbol}_{interval.value}.{storage.value}")
+            if os.path.exists(file_name):
+                return self._normalize(storage.read(file_name))
+        return None
+
+    # 读取大文件，按股票和周期分组（每个进程只读取一次）
+    def _read_bulk(self):
+        path = os.path.abspath(self.location)
+        key = (path, os.path.getmtime(path))
+        with _bulk_lock:
+            frames = _bulk_frames.get(key)
+            if frames is None:
+                storage = Storage(os.path.splitext(path)[1][1:])
+                data = self._normalize(storage.read(path))
+                if "Interval" not in data.columns:
+                    data["Interval"] = Interval.DAY_1.value
+                frames = {}
+                for group, df in data.groupby(["Symbol", "Interval"], sort=False):
+                    frames[group] = df.drop(columns=["Symbol", "Interval"]).sort_index()
+                # 同一文件只保留最新的版本
+                for old in [old for old in _bulk_frames if old[0] == path]:
+                    del _bulk_frames[old]
+                _bulk_frames[key] = frames
+        return frames
+
+    # 时间索引统一为DatetimeIndex（CSV中时区不一致时会读成文本）
+    @staticmethod
+    def _normalize(df):
+        if not isinstance(df.index, pd.DatetimeIndex):
+            df.index = pd.to_datetime(df.index, utc=True)
+        return df.rename_axis("Date")
+
+
+# 回放数据提供者，按固定的顺序和速度逐批回放另一个提供者的K线，结果可以重复
+class ReplayProvider(Provider):
+
+    def __init__(self, provider, rate=None, visible=0):
+        self.provider = provider
+        self.rate = rate  # 每秒回放的K线数量，None表示不限速
+        self.visible = visible  # 开始回放前已经可见的K线数量
+        self.frames = {}
+        self.cursors = {}
+
+    # 返回到当前回放位置为止的K线
+    def history(self, symbol, interval, period=None, start=None):
+        df = self._frame(symbol, interval)
+        return self._slice(df.iloc[:self._cursor(symbol, interval)], period, start)
+
+    # 向前回放指定数量的K线，返回新回放的K线
+    def advance(self, symbol, interval, count=1):
+        df = self._frame(symbol, interval)
+        cursor = self._cursor(symbol, interval)
+        end = min(cursor + count, len(df))
+        self.cursors[(symbol, interval.value)] = end
+        return df.iloc[cursor:end].copy()
+
+    # 逐批回放剩余的K线，按速度等待
+    def stream(self, symbol, interval, batch=1):
+        while True:
+            bars = self.advance(symbol, interval, batch)
+            if bars.empty:
+                return
+            yield bars
+            if self.rate:
+                time.sleep(len(bars) / self.rate)
+
+    def _frame(self, symbol, interval):
+        key = (symbol, interval.value)
+        if key not in self.frames:
+            df = self.provider.history(symbol, interval, period="max")
+            self.frames[key] = df if df is not None else pd.DataFrame()
+        return self.frames[key]
+
+    def _cursor(self, symbol, interval):
+        return self.cursors.get((symbol, interval.value), self.visible)
@@ -1,6 +1,6 @@
 import pandas as pd
 
-from chan.fractal import Fractal
+from chan.fractal import Fractal, FractalList
 from chan.layer import Layer
 from chan.source import Source
 from chan.stick import Stick
@@ -16,7 +16,14 @@ class Segment(Layer):
 
     # 生成一个时间周期的数据（划分线段）
     def generate_interval(self, interval, data):
-        # 初始化空的线段数据集
+        # 笔的端点都是分型
+        state = self._new_state()
+        segments = self._scan(state, FractalList.of(data).items()) + self._finish(state)
+        return self._to_frame(segments)
+
+    # 逐行生成一个时间周期的数据（参考实现，用于校验划分结果）
+    def generate_interval_by_row(self, interval, data):
+        # 初始化线段数据集
         segments = pd.DataFrame(columns=["High", "Low"])
         if len(data) <= self.length:
             return segments
@@ -26,8 +33,50 @@ class Segment(Layer):
 
         # 遍历所有笔
         for index in range(len(data)):
-            current = self._get_item(data, index)
-            strokes.append({"index": index, "item": current})
+            strokes.append(self._get_item(data, index))
+
+            count = len(strokes)
+            current = strokes[0]
+            up = self._is_top(current)
+            # 第二笔或第四笔延续之前的趋势，则合并到前线段
+            if count in (3, 5):
+                last = strokes[-1]
+                if up and last["High"] >= current["High"] or not up and last["Low"] <= current["Low"]:
+                    strokes = [last]
+            # 单数笔突破前一个同方向的笔，则组成线段
+            elif count >= 4 and count % 2 == 0:
+                previous, last = strokes[-3], strokes[-1]
+                if up and last["Low"] <= previous["Low"] or not up and last["High"] >= previous["High"]:
+                    self._keep_item(segments, current)
+                    strokes = [last]
+            # 双数笔延续之前的趋势，则分割成两个线段，中间的最低（最高）点为分割点
+            elif count >= 7:
+                previous, last = strokes[-3], strokes[-1]
+                if up and last["High"] >= previous["High"] or not up and last["Low"] <= previous["Low"]:
+                    self._keep_item(segments, current)
+                    middle = strokes[3:-3]
+                    column = "Low" if up else "High"
+                    extreme = middle[0]
+                    for item in middle[1:]:
+                        if up and item[column] < extreme[column] or not up and item[column] > extreme[column]:
+                            extreme = item
+                    self._keep_item(segments, extreme)
+                    strokes = [last]
+
+        return segments
+
+    # 增量划分线段的初始状态（等待处理的笔）
+    def _new_state(self):
+        return {"strokes": []}
+
+    # 增量划分线段，返回新确定的线段端点
+    def _scan(self, state, items):
+        segments = []
+        strokes = state["strokes"]
+
+        # 遍历所有笔
+        for item in items:
+            strokes.append(item)
 
             count = len(strokes)
             if count == 3:
@@ -41,17 +90,28 @@ class Segment(Layer):
             elif count >= 7 and count % 2 != 0:
                 strokes = self._seven_strokes(segments, strokes)
 
+        state["strokes"] = strokes
         return segments
 
+    # 从笔数据集获取分型数据项
+    def _items(self, data, start):
+        return FractalList.from_frame(data, start).items()
+
+    # 线段端点转换为数据集
+    def _to_frame(self, items):
+        if len(items) == 0:
+            return pd.DataFrame(columns=["High", "Low"])
+        return FractalList.from_items(items).to_frame()
+
     # 如果第二笔延续之前的趋势，则合并到前线段
     def _three_strokes(self, segments, strokes):
         current = strokes[0]
         second = strokes[2]
 
-        if (self._is_top(current["item"])
-                and second["item"]["High"] >= current["item"]["High"]
-                or self._is_bottom(current["item"])
-                and second["item"]["Low"] <= current["item"]["Low"]):
+        if (current.is_top()
+                and second.high() >= current.high()
+                or current.is_bottom()
+                and second.low() <= current.low()):
             return [second]
         return strokes
 
@@ -61,11 +121,11 @@ class Segment(Layer):
         first = strokes[1]
         third = strokes[3]
 
-        if (self._is_top(current["item"])
-                and third["item"]["Low"] <= first["item"]["Low"]
-                or self._is_bottom(current["item"])
-                and third["item"]["High"] >= first["item"]["High"]):
-            self._keep_item(segments, current["item"])
+        if (current.is_top()
+                and third.low() <= first.low()
+                or current.is_bottom()
+                and third.high() >= first.high()):
+            segments.append(current)
             return [third]
         return strokes
 
@@ -74,10 +134,10 @@ class Segment(Layer):
         current = strokes[0]
         fourth = strokes[4]
 
-        if (self._is_top(current["item"])
-                and fourth["item"]["High"] >= current["item"]["High"]
-                or self._is_bottom(current["item"])
-                and fourth["item"]["Low"] <= current["item"]["Low"]):
+        if (current.is_top()
+                and fourth.high() >= current.high()
+                or current.is_bottom()
+                and fourth.low() <= current.low()):
             return [fourth]
         return strokes
 
@@ -87,11 +147,11 @@ class Segment(Layer):
         third = strokes[-3]
         fifth = strokes[-1]
 
-        if (self._is_top(current["item"])
-                and fifth["item"]["Low"] <= third["item"]["Low"]
-                or self._is_bottom(current["item"])
-                and fifth["item"]["High"] >= third["item"]["High"]):
-            self._keep_item(segments, current["item"])
+        if (current.is_top()
+                and fifth.low() <= third.low()
+                or current.is_bottom()
+                and fifth.high() >= third.high()):
+            segments.append(current)
             return [fifth]
         return strokes
 
@@ -101,15 +161,15 @@ class Segment(Layer):
         fourth = strokes[-3]
         sixth = strokes[-1]
 
-        if (self._is_top(current["item"])
-                and sixth["item"]["High"] >= fourth["item"]["High"]
-                or self._is_bottom(current["item"])
-                and sixth["item"]["Low"] <= fourth["item"]["Low"]):
-            self._keep_item(segments, current["item"])
-            if self._is_top(current["item"]):
-                self._keep_item(segments, self._middle_lowest(strokes)["item"])
+        if (current.is_top()
+                and sixth.high() >= fourth.high()
+                or current.is_bottom()
+                and sixth.low() <= fourth.low()):
+            segments.append(current)
+            if current.is_top():
+                segments.append(self._middle_lowest(strokes))
             else:
-                self._keep_item(segments, self._middle_highest(strokes)["item"])
+                segments.append(self._middle_highest(strokes))
             return [sixth]
         return strokes
 
@@ -119,7 +179,7 @@ class Segment(Layer):
         lowest = None
         for index in range(3, len(strokes) - 3):
             low = strokes[index]
-            if lowest is None or low["item"]["Low"] < lowest["item"]["Low"]:
+            if lowest is None or low.low() < lowest.low():
                 lowest = low
         return lowest
 
@@ -129,23 +189,23 @@ class Segment(Layer):
         highest = None
         for index in range(3, len(strokes) - 3):
             high = strokes[index]
-            if highest is None or high["item"]["High"] > highest["item"]["High"]:
+            if highest is None or high.high() > highest.high():
                 highest = high
         return highest
 
 
 if __name__ == '__main__':
     source = Source("SQQQ")
-    source.load_from_csv()
+    source.load()
 
     stick = Stick(source)
-    stick.load_from_csv()
+    stick.load()
 
     fractal = Fractal(stick)
-    fractal.load_from_csv()
+    fractal.load()
 
     stroke = Stroke(fractal)
-    stroke.load_from_csv()
+    stroke.load()
 
     segment = Segment(stroke)
     segment.generate()
@@ -1,10 +1,16 @@
+import json
+import logging
+import os
 from enum import Enum
 
+import numpy as np
 import pandas as pd
-import yfinance as yf
 
-from chan.layer import Layer, Interval
+from chan.layer import Buffer, Layer, Interval
+from chan.metrics import measure
+from chan.provider import Provider
 
+logger = logging.getLogger("chan.source")
 
 # Yahoo财经数据不同周期可下载最大范围
 class Period(Enum):
@@ -17,49 +23,372 @@ class Period(Enum):
     MONTH_1 = "max"
 
 
-# Yahoo财经数据源类
+# 日内周期的分钟数（用于由细周期K线合成粗周期K线）
+class Minutes(Enum):
+    MIN_1 = 1
+    MIN_5 = 5
+    MIN_30 = 30
+    HOUR_1 = 60
+
+
+# A股上午、下午交易时段（开始、结束的分钟数）
+CN_A_SHARE_SESSIONS = [(9 * 60 + 30, 11 * 60 + 30), (13 * 60, 15 * 60)]
+
+# 默认由细周期K线合成的周期（1分钟、5分钟线可下载的范围短，仍然下载）
+RESAMPLED_INTERVALS = (Interval.MIN_30, Interval.HOUR_1, Interval.DAY_1, Interval.WEEK_1, Interval.MONTH_1)
+
+
+# 数据源类（默认从Yahoo财经下载）
 class Source(Layer):
 
-    # 生成数据
-    def generate(self, auto_save=True):
-        for interval in Interval:
+    def __init__(self, parent, provider=None):
+        super().__init__(parent)
+        self.provider = provider or Provider.default()
+
+        # 各周期最后两条K线的指数平均值（时间、快线、慢线、信号线），和数据一起保存，增量下载时接着计算MACD
+        self.ema = {interval.value: None for interval in Interval}
+
+    # 生成数据（可以只下载指定的时间周期）
+    def generate(self, auto_save=True, intervals=Interval):
+        for interval in intervals:
             self.data[interval.value] = self.generate_interval(interval, None)
+            self.streams[interval.value] = None
         if auto_save:
             self.save()
 
-    # 下载一个时间周期的数据
-    def generate_interval(self, interval, data):
+    # 增量下载数据，只下载已保存数据最后时间之后的K线（可以只下载指定的时间周期）
+    def fetch(self, auto_save=True, intervals=Interval):
+        for interval in intervals:
+            self.data[interval.value] = self.fetch_interval(interval, self._stored(interval))
+            self.streams[interval.value] = None
+        if auto_save:
+            self.save()
+
+    # 由已有的最细周期K线合成更大周期的K线，细周期覆盖不到的历史部分仍使用下载的数据（可以只合成指定的时间周期）
+    def resample(self, auto_save=True, intervals=RESAMPLED_INTERVALS):
+        for interval in intervals:
+            fine = self._finest(interval)
+            data = self._stored(interval)
+            if fine is None:
+                self.data[interval.value] = self.fetch_interval(interval, data)
+            else:
+                if data is None or data.empty:
+                    data = self.generate_interval(interval, data)
+                bars = self.resample_interval(interval, fine, self._timezone(data, fine))
+                if data is not None and not data.empty:
+                    # 第一根合成K线可能不完整，使用下载的数据
+                    bars = bars.iloc[1:]
+                    self.data[interval.value] = self.merge(interval, data, bars) if not bars.empty else data
+                else:
+                    self.data[interval.value] = self._calculate(interval, bars)
+            self.streams[interval.value] = None
+        if auto_save:
+            self.save()
+
+    # 由细周期K线合成一个时间周期的K线（开盘价、最高价、最低价、收盘价、成交量）
+    def resample_interval(self, interval, fine, tz=None):
+        if tz is not None:
+            fine = fine.tz_convert(tz) if fine.index.tz is not None else fine.tz_localize("UTC").tz_convert(tz)
+        # 按当地时间分组，避免夏令时切换影响日期
+        index = fine.index.tz_localize(None) if fine.index.tz is not None else fine.index
+        if interval.name in Minutes.__members__:
+            labels = self._intraday_labels(index, Minutes[interval.name].value)
+        elif interval == Interval.DAY_1:
+            labels = index.normalize()
+        elif interval == Interval.WEEK_1:
+            labels = index.normalize() - pd.to_timedelta(index.dayofweek, unit="D")
+        else:
+            labels = index.normalize() - pd.to_timedelta(index.day - 1, unit="D")
+        if fine.index.tz is not None:
+            labels = labels.tz_localize(fine.index.tz, ambiguous=False, nonexistent="shift_forward")
+        bars = fine.groupby(labels.rename("Date"), sort=True).agg(
+            Open=("Open", "first"), High=("High", "max"), Low=("Low", "min"),
+            Close=("Close", "last"), Volume=("Volume", "sum"))
+        return self._filter(interval, bars)
+
+    # 日内K线按交易时段开始时间对齐分组，返回每根K线所属分组的开始时间
+    def _intraday_labels(self, index, size):
+        minutes = index.hour * 60 + index.minute
+        if self._is_cn_a_share():
+            # A股上午、下午分别从开盘时间开始分组，收盘时刻的K线归入最后一组
+            afternoon = minutes >= CN_A_SHARE_SESSIONS[1][0]
+            start = np.where(afternoon, CN_A_SHARE_SESSIONS[1][0], CN_A_SHARE_SESSIONS[0][0])
+            end = np.where(afternoon, CN_A_SHARE_SESSIONS[1][1], CN_A_SHARE_SESSIONS[0][1])
+            groups = np.minimum((minutes - start) // size, np.maximum(end - start - 1, 0) // size)
+        else:
+            # 其他市场从每天第一根K线的时间开始分组
+            start = pd.Series(minutes, index=index).groupby(index.normalize()).transform("min").to_numpy()
+            groups = (minutes - start) // size
+        return index.normalize() + pd.to_timedelta(start + groups * size, unit="min")
+
+    # 可以合成指定周期的最细周期数据（日内周期的分钟数要能整除，周线、月线还可以由日线合成），没有时返回None
+    def _finest(self, interval):
+        target = Minutes[interval.name].value if interval.name in Minutes.__members__ else None
+        for fine in Interval:
+            if fine == interval:
+                return None
+            if fine.name in Minutes.__members__:
+                if target is not None and target % Minutes[fine.name].value != 0:
+                    continue
+            elif fine != Interval.DAY_1:
+                continue
+            data = self._stored(fine)
+            if data is not None and not data.empty:
+                return data
+        return None
+
+    # 合成K线使用的交易所时区（A股为北京时间，其他使用已有数据的时区）
+    def _timezone(self, *frames):
+        if self._is_cn_a_share():
+            return "Asia/Shanghai"
+        for data in frames:
+            if data is not None and isinstance(data.index, pd.DatetimeIndex) and data.index.tz is not None:
+                if str(data.index.tz) != "UTC":
+                    return data.index.tz
+        return "UTC"
+
+    # 已有的数据，没有加载时从文件加载
+    def _stored(self, interval):
+        if self.get_data(interval) is None and os.path.exists(self.get_file_name(interval)):
+            self.load([interval])
+        data = self.get_data(interval)
+        if data is not None and not data.empty and not isinstance(data.index, pd.DatetimeIndex):
+            data = data.set_axis(pd.to_datetime(data.index, utc=True))
+        return data
+
+    # 增量下载一个时间周期的数据，没有已保存的数据时下载全部数据（下载失败时保留已有数据，记录在测量结果中）
+    def fetch_interval(self, interval, data):
+        if data is None or data.empty:
+            return self.generate_interval(interval, data)
+        with measure(self.name, interval.value, "fetch", self._rows(data)) as sample:
+            try:
+                # 最后一条K线保存时可能还没有结束，从它开始重新下载
+                bars = self._history(interval, start=data.index[-1])
+                if bars is None or bars.empty:
+                    # 最后时间超出了可下载的范围，下载全部数据再合并
+                    bars = self._history(interval, period=Period[interval.name].value)
+                if bars is not None and not bars.empty:
+                    data = self.merge(interval, data, bars)
+            except Exception as e:
+                logger.error(f"Error fetching {self.symbol} data for {interval.value}: {e}")
+                sample.error = f"{type(e).__name__}: {e}"
+            sample.rows_out = self._rows(data)
+        return data
+
+    # 合并新下载的K线：新K线替换相同时间及之后的已有K线，只对新K线计算MACD
+    def merge(self, interval, data, bars):
+        bars = self._filter(interval, bars)
+        if bars.empty:
+            return data
+        data, bars = self._align(data, bars)
+        bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+        history = data[data.index < bars.index[0]]
+        if history.empty:
+            return self._calculate(interval, bars.copy())
+        if bars.index[0] > data.index[-1]:
+            logger.warning(f"Gap in {self.symbol} data for {interval.value}: {data.index[-1]} - {bars.index[0]}")
+
+        # 保留部分的MACD不变，新K线接着保留部分最后的指数平均值计算
+        bars = bars.drop(columns=["MACD", "Signal", "Histogram"], errors="ignore")
+        self._calculate(interval, bars, self._ema_state(interval, history))
+        return pd.concat([history, bars])
+
+    # 计算MACD（可以接着指定的指数平均值），记录最后两条K线的指数平均值
+    def _calculate(self, interval, df, state=None):
+        ema_fast, ema_slow = self._continue_macd(df, state or {})
+        self._remember(interval, df.index, ema_fast, ema_slow, df["Signal"].to_numpy(), state)
+        return df
+
+    def _remember(self, interval, dates, ema_fast, ema_slow, signal, state=None):
+        states = [state] if state and "date" in state else []
+        states += [{"date": date, "fast": float(fast), "slow": float(slow), "signal": float(value)}
+                   for date, fast, slow, value in zip(dates[-2:], ema_fast[-2:], ema_slow[-2:], signal[-2:])]
+        self.ema[interval.value] = states[-2:]
+
+    # 已有数据最后一条K线的指数平均值：优先使用记录的值（内存中或和数据一起保存的文件），
+    # 和数据中的MACD、信号线一致时才使用，否则对已有数据重新计算
+    def _ema_state(self, interval, history):
+        date, macd, signal = history.index[-1], history["MACD"].iloc[-1], history["Signal"].iloc[-1]
+        for state in (self.ema[interval.value] or []) + self._read_ema(interval):
+            if (pd.Timestamp(state["date"]) == date
+                    and np.isclose(state["fast"] - state["slow"], macd, rtol=1e-9, atol=1e-12)
+                    and np.isclose(state["signal"], signal, rtol=1e-9, atol=1e-12)):
+                return state
+        close = history['Close'].to_numpy(dtype=float)
+        return {"date": date,
+                "fast": self._continue_ewm(close, 12, None)[-1],
+                "slow": self._continue_ewm(close, 26, None)[-1],
+                "signal": signal}
+
+    # 指数平均值文件名（和数据文件放在一起）
+    def _ema_file_name(self, interval):
+        return f'{self.path}/{self.name}_{interval.value}.ema.json'
+
+    def _read_ema(self, interval):
+        file_name = self._ema_file_name(interval)
+        if not os.path.exists(file_name):
+            return []
         try:
-            ticker = yf.Ticker(self.symbol)
-            df = ticker.history(
-                period=Period[interval.name].value,
-                interval=interval.value,
-                actions=False
-            )
-
-            if df is not None and not df.empty:
-                if self.symbol.endswith(".SZ") or self.symbol.endswith(".SS"):
-                    if interval in [Interval.MIN_1, Interval.MIN_5, Interval.MIN_30, Interval.HOUR_1]:
-                        df = self.filter_cn_a_share_trading_time(df)
-                df = self.calculate_macd(df)
-            return df
-
-        except Exception as e:
-            print(f"Error fetching {self.symbol} data for {interval.value}: {e}")
-            return None
+            with open(file_name) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading {file_name}: {e}")
+            return []
+
+    # 保存数据，同时保存最后两条K线的指数平均值（和数据不一致的记录不保存，并删除已有的文件）
+    def _save(self, storage):
+        super()._save(storage)
+        for interval in Interval:
+            data = self.get_data(interval)
+            if data is None:
+                continue
+            states = self.ema[interval.value] or []
+            file_name = self._ema_file_name(interval)
+            if len(data) > 0 and states and pd.Timestamp(states[-1]["date"]) == data.index[-1]:
+                with open(file_name, "w") as file:
+                    json.dump([{**state, "date": pd.Timestamp(state["date"]).isoformat()} for state in states], file)
+            elif os.path.exists(file_name):
+                os.remove(file_name)
+
+    # 已有数据和新K线统一为相同时区的时间索引
+    @staticmethod
+    def _align(data, bars):
+        if not isinstance(data.index, pd.DatetimeIndex):
+            data = data.set_axis(pd.to_datetime(data.index, utc=True))
+        if bars.index.tz is None:
+            bars = bars.tz_localize("UTC")
+        if data.index.tz is None:
+            data = data.tz_localize("UTC")
+        return data.tz_convert(bars.index.tz), bars
+
+    # 增量追加一个时间周期的K线（最后一条K线可能还在变化，暂不确认），返回新确认的K线和尚未确认的K线
+    def update(self, interval, bars):
+        stream = self.streams[interval.value]
+        if stream is None:
+            # 第一次更新，已有的数据都还没有确认
+            stream = {"state": {}, "confirmed": 0, "consumed": 0}
+            self.streams[interval.value] = stream
+
+        # 已确认的K线保存在Buffer中不再复制，只处理尾部和新K线
+        count = stream["confirmed"]
+        buffer = self.data.buffer(interval.value)
+        if buffer is None or buffer.confirmed != count:
+            data = self.get_data(interval)
+            if data is None:
+                data = bars.iloc[:0]
+            buffer = Buffer(data.iloc[:count] if count > 0 else None, data.iloc[count:])
+            self.data[interval.value] = buffer
+        tail = buffer.tail
+        index = buffer.chunks[-1].index if buffer.chunks else tail.index
+
+        # 只接受最后确认时间之后的K线，相同时间的K线用新数据替换
+        if len(bars) > 0:
+            bars = self._filter(interval, bars)
+            if getattr(index, "tz", None) is not None and bars.index.tz is not None:
+                bars = bars.tz_convert(index.tz)
+        if count > 0 and len(bars) > 0:
+            bars = bars[bars.index > buffer.last_date()]
+        if len(tail) > 0:
+            tail = tail.drop(columns=["MACD", "Signal", "Histogram"], errors="ignore")
+            bars = pd.concat([tail, bars]) if len(bars) > 0 else tail
+        bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+        if len(bars) == 0:
+            return bars, bars
+
+        # 接着已确认K线的指数平均值计算MACD，并保存最后一条确认K线的状态
+        ema_fast, ema_slow = self._continue_macd(bars, stream["state"])
+        if len(bars) > 1:
+            stream["state"] = {"fast": ema_fast[-2], "slow": ema_slow[-2], "signal": bars["Signal"].iloc[-2]}
+        self._remember(interval, bars.index, ema_fast, ema_slow, bars["Signal"].to_numpy())
+
+        confirmed, tail = bars.iloc[:-1], bars.iloc[-1:]
+        buffer.append(confirmed, tail)
+        stream["confirmed"] = count + len(confirmed)
+        return confirmed, tail
+
+    # 下载一个时间周期的数据（下载失败时返回None，记录在测量结果中）
+    def generate_interval(self, interval, data):
+        with measure(self.name, interval.value, "download") as sample:
+            try:
+                df = self._history(interval, period=Period[interval.name].value)
+
+                if df is not None and not df.empty:
+                    df = self._filter(interval, df)
+                    df = self._calculate(interval, df)
+                sample.rows_out = self._rows(df)
+                return df
+
+            except Exception as e:
+                logger.error(f"Error fetching {self.symbol} data for {interval.value}: {e}")
+                sample.error = f"{type(e).__name__}: {e}"
+                return None
+
+    # 从数据提供者获取K线，可以指定时间范围（period）或开始时间（start）
+    def _history(self, interval, period=None, start=None):
+        return self.provider.history(self.symbol, interval, period=period, start=start)
+
+    # A股分钟、小时数据只保留交易时段
+    def _filter(self, interval, df):
+        if self._is_cn_a_share():
+            if interval in [Interval.MIN_1, Interval.MIN_5, Interval.MIN_30, Interval.HOUR_1]:
+                df = self.filter_cn_a_share_trading_time(df)
+        return df
+
+    def _is_cn_a_share(self):
+        return self.symbol.endswith(".SZ") or self.symbol.endswith(".SS")
 
     @staticmethod
     def filter_cn_a_share_trading_time(df):
         if df.index.tz is None:
             df.index = df.index.tz_localize("UTC")
         df = df.tz_convert("Asia/Shanghai")
+        return df[Source._session_mask(df.index, CN_A_SHARE_SESSIONS)].copy()
+
+    # 交易时段掩码，用一天中的分钟数比较（时段结束时刻只包含整分钟）
+    @staticmethod
+    def _session_mask(index, sessions):
+        minutes = (index.hour * 60 + index.minute).to_numpy()
+        on_minute = ((index.second == 0) & (index.microsecond == 0) & (index.nanosecond == 0))
+        mask = np.zeros(len(index), dtype=bool)
+        for start, end in sessions:
+            mask |= ((minutes >= start) & (minutes < end)) | ((minutes == end) & on_minute)
+        return mask
 
-        time_mask = (
-                ((df.index.time >= pd.Timestamp("09:30").time())
-                 & (df.index.time <= pd.Timestamp("11:30").time()))
-                | ((df.index.time >= pd.Timestamp("13:00").time())
-                   & (df.index.time <= pd.Timestamp("15:00").time())))
-        return df[time_mask].copy()
+    # 批量预处理多个股票的长表数据（Symbol列区分股票，时间为索引）：
+    # A股分钟、小时数据只保留交易时段，再按股票分组一次计算所有股票的MACD
+    @staticmethod
+    def prepare_panel(panel, interval, fast=12, slow=26, signal=9):
+        if panel.index.tz is None:
+            panel = panel.tz_localize("UTC")
+        codes, symbols = pd.factorize(panel["Symbol"], sort=True)
+        if interval in [Interval.MIN_1, Interval.MIN_5, Interval.MIN_30, Interval.HOUR_1]:
+            cn_a_share = np.array([str(symbol).endswith((".SZ", ".SS")) for symbol in symbols], dtype=bool)
+            if cn_a_share.any():
+                local = panel.index.tz_convert("Asia/Shanghai")
+                mask = ~cn_a_share[codes] | Source._session_mask(local, CN_A_SHARE_SESSIONS)
+                panel, codes = panel[mask], codes[mask]
+
+        # 按股票、时间排序后，每个股票一列排成二维数组（较短的股票末尾补空值），所有股票一次计算
+        order = np.lexsort((panel.index.asi8, codes))
+        panel, codes = panel.iloc[order].copy(), codes[order]
+        starts = np.searchsorted(codes, np.arange(len(symbols)))
+        positions = np.arange(len(codes)) - starts[codes]
+        shape = (positions.max() + 1 if len(codes) > 0 else 0, len(symbols))
+        close = panel["Close"].to_numpy(dtype=float)
+        macd = (Source._grouped_ewm(close, codes, positions, shape, fast)
+                - Source._grouped_ewm(close, codes, positions, shape, slow))
+        panel["MACD"] = macd
+        panel["Signal"] = Source._grouped_ewm(macd, codes, positions, shape, signal)
+        panel["Histogram"] = panel["MACD"] - panel["Signal"]
+        return panel
+
+    # 分组计算指数平均值（每组一列，按列计算）
+    @staticmethod
+    def _grouped_ewm(values, codes, positions, shape, span):
+        table = np.full(shape, np.nan)
+        table[positions, codes] = values
+        ema = pd.DataFrame(table).ewm(span=span, adjust=False).mean().to_numpy()
+        return ema[positions, codes]
 
     @staticmethod
     def calculate_macd(df, fast=12, slow=26, signal=9):
@@ -71,6 +400,26 @@ class Source(Layer):
         df['Histogram'] = df['MACD'] - df['Signal']
         return df
 
+    # 接着上次的指数平均值计算MACD，返回快、慢指数平均值
+    @staticmethod
+    def _continue_macd(df, state, fast=12, slow=26, signal=9):
+        close = df['Close'].to_numpy(dtype=float)
+        ema_fast = Source._continue_ewm(close, fast, state.get("fast"))
+        ema_slow = Source._continue_ewm(close, slow, state.get("slow"))
+
+        df['MACD'] = ema_fast - ema_slow
+        df['Signal'] = Source._continue_ewm(df['MACD'].to_numpy(), signal, state.get("signal"))
+        df['Histogram'] = df['MACD'] - df['Signal']
+        return ema_fast, ema_slow
+
+    # 以上次的指数平均值作为第一个值继续计算（不调整权重时结果和整体计算一致）
+    @staticmethod
+    def _continue_ewm(values, span, previous):
+        if previous is not None:
+            values = np.concatenate([[previous], values])
+        ema = pd.Series(values).ewm(span=span, adjust=False).mean().to_numpy()
+        return ema[1:] if previous is not None else ema
+
 
 if __name__ == '__main__':
     source = Source("SQQQ")
@@ -14,6 +14,24 @@ class Stick(Layer):
         if len(data) < 2:
             return sticks
 
+        # 在连续的最高价、最低价数组上合并，最后一次性生成线数据集
+        state = self._new_state()
+        positions, highs, lows = self._merge(state, range(len(data)),
+                                             data["High"].to_numpy(dtype=float).tolist(),
+                                             data["Low"].to_numpy(dtype=float).tolist())
+        position, high, low = self._finish(state)[0]
+        positions.append(position)
+        highs.append(high)
+        lows.append(low)
+        return pd.DataFrame({"High": highs, "Low": lows}, index=data.index[positions])
+
+    # 逐行生成一个时间周期的数据（参考实现，用于校验合并结果）
+    def generate_interval_by_row(self, interval, data):
+        # 初始化线数据集
+        sticks = pd.DataFrame(columns=["High", "Low"])
+        if len(data) < 2:
+            return sticks
+
         # 找到第一条可以确定方向的K线作为起点
         previous = current = None
         index = 0
@@ -49,6 +67,81 @@ class Stick(Layer):
         self._keep_item(sticks, current)
         return sticks
 
+    # 增量合并的初始状态（已处理的K线数量、上一条保存的线、当前还在合并的线）
+    def _new_state(self):
+        return {"count": 0, "previous": None, "current": None}
+
+    # 增量合并K线，返回新确定的线（时间、最高价、最低价）
+    def _scan(self, state, items):
+        if len(items) == 0:
+            return []
+        dates, highs, lows = zip(*items)
+        return list(zip(*self._merge(state, dates, highs, lows)))
+
+    # 输入结束，当前线也确定下来（至少两条K线才有线）
+    def _finish(self, state):
+        return [state["current"]] if state["count"] >= 2 else []
+
+    # 接着状态合并K线，返回新确定线的键（位置或时间）、最高价和最低价
+    @staticmethod
+    def _merge(state, keys, high, low):
+        kept_keys, kept_highs, kept_lows = [], [], []
+        count = len(high)
+        previous, current = state["previous"], state["current"]
+        state["count"] += count
+
+        # 还没有确定方向时，找到第一条可以确定方向的K线作为起点
+        index = 0
+        while previous is None and index < count:
+            if current is not None:
+                current_key, current_high, current_low = current
+                if (current_high <= high[index] and current_low <= low[index]
+                        or current_high >= high[index] and current_low >= low[index]):
+                    kept_keys.append(current_key)
+                    kept_highs.append(current_high)
+                    kept_lows.append(current_low)
+                    previous = (current_high, current_low)
+            current = (keys[index], high[index], low[index])
+            index += 1
+
+        if previous is None:
+            state["current"] = current
+            return kept_keys, kept_highs, kept_lows
+
+        previous_high, previous_low = previous
+        current_key, current_high, current_low = current
+
+        # 遍历剩余K线
+        for i in range(index, count):
+            first_high, first_low = high[i], low[i]
+
+            # 根据线的走势决定合并最低价，还是最高价
+            go_up = previous_high <= current_high and previous_low <= current_low
+
+            # 如果当前线包含下一条线，则将其合并
+            if current_high >= first_high and current_low <= first_low:
+                if go_up:
+                    current_low = first_low
+                else:
+                    current_high = first_high
+            # 如果当前线被下一条线包含，则合并到下一条线
+            elif current_high <= first_high and current_low >= first_low:
+                if go_up:
+                    current_key, current_high = keys[i], first_high
+                else:
+                    current_key, current_low = keys[i], first_low
+            # 如果没有包含关系，则保存当前线，继续处理下一条线
+            else:
+                kept_keys.append(current_key)
+                kept_highs.append(current_high)
+                kept_lows.append(current_low)
+                previous_high, previous_low = current_high, current_low
+                current_key, current_high, current_low = keys[i], first_high, first_low
+
+        state["previous"] = (previous_high, previous_low)
+        state["current"] = (current_key, current_high, current_low)
+        return kept_keys, kept_highs, kept_lows
+
     # 下一条线是否向上
     @staticmethod
     def _is_go_up(current, after):
@@ -72,7 +165,7 @@ class Stick(Layer):
 
 if __name__ == '__main__':
     source = Source("SQQQ")
-    source.load_from_csv()
+    source.load()
 
     stick = Stick(source)
     stick.generate()
@@ -0,0 +1,63 @@
+import os
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+
+# 数据存储格式
+class Storage(Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+    NPZ = "npz"
+
+    # 当前部署使用的存储格式（环境变量CHAN_STORAGE，默认CSV）
+    @staticmethod
+    def default():
+        return Storage(os.environ.get("CHAN_STORAGE", Storage.CSV.value))
+
+    # 写入数据
+    def write(self, data, file_name):
+        if self is Storage.CSV:
+            data.to_csv(file_name, index_label='Date')
+        elif self is Storage.PARQUET:
+            # 需要安装pyarrow或fastparquet
+            data.rename_axis('Date').to_parquet(file_name)
+        else:
+            self._write_npz(data, file_name)
+
+    # 读取数据
+    def read(self, file_name):
+        if self is Storage.CSV:
+            return pd.read_csv(file_name, index_col=0, parse_dates=True)
+        elif self is Storage.PARQUET:
+            return pd.read_parquet(file_name)
+        else:
+            return self._read_npz(file_name)
+
+    # 按列保存为NumPy数组（时间保存为UTC纳秒整数和时区名称），读取时不需要解析文本
+    @staticmethod
+    def _write_npz(data, file_name):
+        index = data.index
+        if not isinstance(index, pd.DatetimeIndex):
+            index = pd.to_datetime(index, utc=True)
+        arrays = {"index": index.as_unit("ns").asi8,
+                  "timezone": np.array(str(index.tz) if index.tz is not None else ""),
+                  "columns": np.array(data.columns, dtype=str)}
+        for number, column in enumerate(data.columns):
+            values = data[column].to_numpy()
+            arrays[f"column_{number}"] = values.astype(float) if values.dtype == object else values
+        # 先写临时文件再替换，避免读到写了一半的文件
+        with open(f"{file_name}.tmp", "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(f"{file_name}.tmp", file_name)
+
+    @staticmethod
+    def _read_npz(file_name):
+        with np.load(file_name, allow_pickle=False) as arrays:
+            timezone = str(arrays["timezone"])
+            index = pd.to_datetime(arrays["index"], utc=True)
+            index = index.tz_convert(timezone) if timezone else index.tz_localize(None)
+            columns = arrays["columns"].tolist()
+            data = {column: arrays[f"column_{number}"] for number, column in enumerate(columns)}
+        return pd.DataFrame(data, index=index.rename('Date'), columns=columns)
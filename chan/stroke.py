@@ -1,6 +1,6 @@
 import pandas as pd
 
-from chan.fractal import Fractal
+from chan.fractal import Fractal, FractalList
 from chan.layer import Layer
 from chan.source import Source
 from chan.stick import Stick
@@ -15,45 +15,90 @@ class Stroke(Layer):
 
     # 生成一个时间周期的数据（划分笔）
     def generate_interval(self, interval, data):
-        # 初始化空的笔数据集
+        # 只遍历真正的分型
+        state = self._new_state()
+        strokes = self._scan(state, FractalList.of(data).items()) + self._finish(state)
+        return self._to_frame(strokes)
+
+    # 逐行生成一个时间周期的数据（参考实现，用于校验划分结果）
+    def generate_interval_by_row(self, interval, data):
+        # 初始化笔数据集
         strokes = pd.DataFrame(columns=["High", "Low"])
         if len(data) <= self.length:
             return strokes
 
-        # 等待处理的分型
+        # 等待处理的分型（位置、数据项）
         fractals = []
 
-        # 遍历所有分型
+        # 遍历所有线，只处理分型
         for index in range(len(data)):
             current = self._get_item(data, index)
-            if self._is_fractal(current):
-                fractals.append({"index": index, "item": current})
-
-                count = len(fractals)
-                if count == 2:
-                    fractals = self._two_fractals(strokes, fractals)
-                elif count == 3:
-                    fractals = self._three_fractals(strokes, fractals)
-                elif count == 4:
-                    fractals = self._four_fractals(strokes, fractals)
-                elif count == 5:
-                    fractals = self._five_fractals(strokes, fractals)
-                elif count == 6:
-                    fractals = self._six_fractals(strokes, fractals)
+            if not self._is_top(current) and not self._is_bottom(current):
+                continue
+            fractals.append((index, current))
+
+            count = len(fractals)
+            first_index, first = fractals[0]
+            last_index, last = fractals[-1]
+            # 两个或四个分型距离足够时组成一笔，六个分型一定组成一笔
+            if (count in (2, 4) and last_index - first_index >= self.length
+                    or count == 6):
+                self._keep_item(strokes, first)
+                fractals = [fractals[-1]]
+            # 第三个或第五个分型延续之前的趋势，则和前笔合并
+            elif count in (3, 5) and (self._is_top(first)
+                                      and last["High"] >= first["High"]
+                                      or self._is_bottom(first)
+                                      and last["Low"] <= first["Low"]):
+                fractals = [fractals[-1]]
 
         return strokes
 
-    # 判断是否为分型
-    def _is_fractal(self, current):
-        return self._is_top(current) or self._is_bottom(current)
+    # 增量划分笔的初始状态（等待处理的分型）
+    def _new_state(self):
+        return {"fractals": []}
+
+    # 增量划分笔，返回新确定的笔端点
+    def _scan(self, state, items):
+        strokes = []
+        fractals = state["fractals"]
+
+        # 遍历所有分型
+        for item in items:
+            fractals.append(item)
+
+            count = len(fractals)
+            if count == 2:
+                fractals = self._two_fractals(strokes, fractals)
+            elif count == 3:
+                fractals = self._three_fractals(strokes, fractals)
+            elif count == 4:
+                fractals = self._four_fractals(strokes, fractals)
+            elif count == 5:
+                fractals = self._five_fractals(strokes, fractals)
+            elif count == 6:
+                fractals = self._six_fractals(strokes, fractals)
+
+        state["fractals"] = fractals
+        return strokes
+
+    # 从分型数据集获取分型数据项
+    def _items(self, data, start):
+        return FractalList.from_frame(data, start).items()
+
+    # 笔端点转换为数据集
+    def _to_frame(self, items):
+        if len(items) == 0:
+            return pd.DataFrame(columns=["High", "Low"])
+        return FractalList.from_items(items).to_frame()
 
     # 如果两个分型是否可以组成完整的笔
     def _two_fractals(self, strokes, fractals):
         current = fractals[0]
         first = fractals[1]
 
-        if first["index"] - current["index"] >= self.length:
-            self._keep_item(strokes, current["item"])
+        if first.position - current.position >= self.length:
+            strokes.append(current)
             return [first]
         return fractals
 
@@ -62,10 +107,10 @@ class Stroke(Layer):
         current = fractals[0]
         second = fractals[2]
 
-        if (self._is_top(current["item"])
-                and second["item"]["High"] >= current["item"]["High"]
-                or self._is_bottom(current["item"])
-                and second["item"]["Low"] <= current["item"]["Low"]):
+        if (current.is_top()
+                and second.high() >= current.high()
+                or current.is_bottom()
+                and second.low() <= current.low()):
             return [second]
         return fractals
 
@@ -74,8 +119,8 @@ class Stroke(Layer):
         current = fractals[0]
         third = fractals[3]
 
-        if third["index"] - current["index"] >= self.length:
-            self._keep_item(strokes, current["item"])
+        if third.position - current.position >= self.length:
+            strokes.append(current)
             return [third]
         return fractals
 
@@ -84,10 +129,10 @@ class Stroke(Layer):
         current = fractals[0]
         fourth = fractals[4]
 
-        if (self._is_top(current["item"])
-                and fourth["item"]["High"] >= current["item"]["High"]
-                or self._is_bottom(current["item"])
-                and fourth["item"]["Low"] <= current["item"]["Low"]):
+        if (current.is_top()
+                and fourth.high() >= current.high()
+                or current.is_bottom()
+                and fourth.low() <= current.low()):
             return [fourth]
         return fractals
 
@@ -96,19 +141,19 @@ class Stroke(Layer):
         current = fractals[0]
         fifth = fractals[5]
 
-        self._keep_item(strokes, current["item"])
+        strokes.append(current)
         return [fifth]
 
 
 if __name__ == '__main__':
     source = Source("SQQQ")
-    source.load_from_csv()
+    source.load()
 
     stick = Stick(source)
-    stick.load_from_csv()
+    stick.load()
 
     fractal = Fractal(stick)
-    fractal.load_from_csv()
+    fractal.load()
 
     stroke = Stroke(fractal)
     stroke.generate()
@@ -0,0 +1,233 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from chan import macd
+
+UP = 1
+DOWN = -1
+
+# 汇总表的列和类型（时间保存为UTC的ISO格式文本，按文本比较就是按时间比较）
+COLUMNS = {
+    "bars": "INTEGER", "date": "TEXT", "close": "REAL", "histogram": "REAL",
+    "strokes": "INTEGER", "stroke_direction": "INTEGER", "stroke_start": "TEXT", "stroke_end": "TEXT",
+    "stroke_from": "REAL", "stroke_to": "REAL", "stroke_area": "REAL", "previous_area": "REAL",
+    "decline": "INTEGER", "rally": "INTEGER",
+    "segment_direction": "INTEGER", "segment_end": "TEXT", "segment_position": "INTEGER",
+    "pivot_start": "TEXT", "pivot_end": "TEXT", "pivot_high": "REAL", "pivot_low": "REAL",
+    "stroke_pivot_start": "TEXT", "stroke_pivot_end": "TEXT", "stroke_pivot_high": "REAL", "stroke_pivot_low": "REAL",
+    "fractal": "INTEGER", "fractal_date": "TEXT", "fractal_position": "INTEGER",
+}
+
+
+# 数据源：K线数量、最后时间、收盘价、MACD柱状图
+def _source(data, dates, histogram):
+    if len(data) == 0:
+        return {"bars": 0, "date": pd.NaT, "close": np.nan, "histogram": np.nan}
+    return {"bars": len(data), "date": dates[-1],
+            "close": float(data["Close"].iloc[-1]), "histogram": float(data["Histogram"].iloc[-1])}
+
+
+# 最后一笔（方向、起止时间和价格、MACD面积）、前一个同向笔的MACD面积、连续下跌（上涨）的笔数
+def _strokes(data, dates, histogram):
+    summary = {"strokes": 0, "stroke_direction": 0, "stroke_start": pd.NaT, "stroke_end": pd.NaT,
+               "stroke_from": np.nan, "stroke_to": np.nan, "stroke_area": np.nan, "previous_area": np.nan,
+               "decline": 0, "rally": 0}
+    if len(data) < 2:
+        return summary
+    high = data["High"].to_numpy(dtype=float)
+    low = data["Low"].to_numpy(dtype=float)
+    prices = np.where(np.isnan(high), low, high)
+    summary.update({"strokes": len(data) - 1,
+                    "stroke_direction": UP if np.isnan(low[-1]) else DOWN,
+                    "stroke_start": data.index[-2], "stroke_end": data.index[-1],
+                    "stroke_from": prices[-2], "stroke_to": prices[-1]})
+
+    if histogram is not None:
+        # 每一笔的MACD面积（和背驰的面积相同：起点之后到终点的K线，向上取红柱面积，向下取绿柱面积）
+        red, green = histogram
+        positions = np.minimum(np.searchsorted(dates, data.index), len(dates) - 1) + 1
+        areas = macd.areas(np.isnan(low), red[positions], green[positions])
+        summary["stroke_area"] = areas[-1]
+        summary["previous_area"] = areas[-3] if len(areas) >= 3 else np.nan
+
+    # 从最后往前数，终点低于（高于）前一个同向笔终点的连续笔数
+    summary["decline"] = _trailing(prices[2:] < prices[:-2])
+    summary["rally"] = _trailing(prices[2:] > prices[:-2])
+    return summary
+
+
+# 末尾连续为True的数量
+def _trailing(flags):
+    false = np.flatnonzero(~flags)
+    return int(len(flags) - 1 - false[-1]) if len(false) > 0 else len(flags)
+
+
+# 最后一个线段（方向、结束时间、结束时在数据源中的位置）
+def _segments(data, dates, histogram):
+    if len(data) < 2:
+        return {"segment_direction": 0, "segment_end": pd.NaT, "segment_position": None}
+    return {"segment_direction": UP if np.isnan(data["Low"].iloc[-1]) else DOWN,
+            "segment_end": data.index[-1],
+            "segment_position": int(np.searchsorted(dates, data.index[-1])) if dates is not None else None}
+
+
+# 最后一个中枢（起止时间、最高价、最低价）
+def _pivot(name):
+    def summarize(data, dates, histogram):
+        if len(data) < 2:
+            return {f"{name}_start": pd.NaT, f"{name}_end": pd.NaT, f"{name}_high": np.nan, f"{name}_low": np.nan}
+        last = data.iloc[len(data) // 2 * 2 - 2:len(data) // 2 * 2]
+        return {f"{name}_start": last.index[0], f"{name}_end": last.index[1],
+                f"{name}_high": float(last["High"].max()), f"{name}_low": float(last["Low"].min())}
+
+    return summarize
+
+
+# 最后一个分型（顶分型为1，底分型为-1、时间、在数据源中的位置）
+def _fractal(data, dates, histogram):
+    high = data["High"].to_numpy(dtype=float)
+    low = data["Low"].to_numpy(dtype=float)
+    found = np.flatnonzero(np.isnan(high) != np.isnan(low))
+    if len(found) == 0:
+        return {"fractal": 0, "fractal_date": pd.NaT, "fractal_position": None}
+    last = found[-1]
+    return {"fractal": UP if np.isnan(low[last]) else DOWN, "fractal_date": data.index[last],
+            "fractal_position": int(np.searchsorted(dates, data.index[last])) if dates is not None else None}
+
+
+# 各层汇总的内容（合并K线没有汇总）
+SUMMARIES = {
+    "source": _source,
+    "fractal": _fractal,
+    "stroke": _strokes,
+    "strokepivot": _pivot("stroke_pivot"),
+    "segment": _segments,
+    "segmentpivot": _pivot("pivot"),
+}
+
+
+# 每个进程共用的汇总表（按文件名）
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+# 每个股票每个周期一行的最新状态汇总表（SQLite文件），各层保存数据时更新自己的列，
+# 看板、选股只需要读这一个小文件，不需要加载各层的数据文件
+#   同一进程中共用一个连接（各线程加锁使用），表只在打开连接时创建一次，子进程重新打开连接
+class SummaryIndex:
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name or Path(__file__).parent.parent / "data" / "summary.db"
+        self.connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    # 当前进程共用的汇总表
+    @staticmethod
+    def shared(file_name=None):
+        file_name = str(file_name or Path(__file__).parent.parent / "data" / "summary.db")
+        with _indexes_lock:
+            index = _indexes.get(file_name)
+            if index is None:
+                index = _indexes[file_name] = SummaryIndex(file_name)
+            return index
+
+    # 用一层当前的数据更新汇总表（只更新有数据的周期）
+    def update(self, layer):
+        summarize = SUMMARIES.get(layer.name)
+        if summarize is None:
+            return
+        rows = []
+        for interval, data in layer.data.items():
+            if data is None:
+                continue
+            data = layer._as_frame(data)
+            dates, histogram = self._source(layer, interval)
+            data = data.set_axis(pd.to_datetime(data.index, utc=True)) if len(data) > 0 else data
+            rows.append({"symbol": layer.symbol, "interval": interval, **summarize(data, dates, histogram)})
+        if rows:
+            self._write(rows)
+
+    # 读取一个周期所有股票的汇总（各列按类型转换，整数列为可以为空的整数，计算分型、线段之后的K线数量）
+    def read(self, interval):
+        if self.connection is None and not os.path.exists(self.file_name):
+            table = pd.DataFrame(columns=["symbol", "interval", *COLUMNS])
+        else:
+            with self.lock:
+                table = pd.read_sql_query("SELECT * FROM summary WHERE interval = ?", self._connect(),
+                                          params=(interval,))
+        for column, kind in COLUMNS.items():
+            if kind == "TEXT":
+                table[column] = pd.to_datetime(table[column], utc=True, format="ISO8601")
+            elif kind == "INTEGER":
+                # 有空值的整数列读出来是浮点数，全部为空的列读出来是对象
+                table[column] = table[column].astype("Int64")
+            else:
+                table[column] = table[column].astype(float)
+        table["bars_since_segment"] = table["bars"] - 1 - table["segment_position"]
+        table["bars_since_fractal"] = table["bars"] - 1 - table["fractal_position"]
+        return table
+
+    # 数据源的时间和MACD柱状图红柱、绿柱前缀和（数据源不在内存中时为None）
+    @staticmethod
+    def _source(layer, interval):
+        while layer.parent is not None:
+            layer = layer.parent
+        data = layer.data.get(interval)
+        if data is None or len(data) == 0:
+            return None, None
+        return pd.to_datetime(data.index, utc=True), macd.prefix(data["Histogram"])
+
+    # 写入（只更新给出的列），多个进程同时写入时等待锁
+    def _write(self, rows):
+        columns = [column for column in rows[0] if column not in ("symbol", "interval")]
+        names = ", ".join(["symbol", "interval", *columns])
+        values = ", ".join("?" * (len(columns) + 2))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    f"INSERT INTO summary ({names}) VALUES ({values}) "
+                    f"ON CONFLICT (symbol, interval) DO UPDATE SET {updates}",
+                    [[self._value(row[column]) for column in ["symbol", "interval", *columns]] for row in rows])
+
+    # 删除一个股票所有周期的汇总
+    def remove(self, symbol):
+        if self.connection is None and not os.path.exists(self.file_name):
+            return
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM summary WHERE symbol = ?", (symbol,))
+
+    # 打开连接并创建表（每个进程只做一次，调用时已加锁）
+    def _connect(self):
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        os.makedirs(Path(self.file_name).parent, exist_ok=True)
+        connection = sqlite3.connect(self.file_name, timeout=30, check_same_thread=False)
+        columns = ", ".join(f"{column} {kind}" for column, kind in COLUMNS.items())
+        with connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS summary (symbol TEXT, interval TEXT, {columns}, "
+                               f"PRIMARY KEY (symbol, interval))")
+        self.connection, self.pid = connection, os.getpid()
+        return connection
+
+    # 转换为SQLite支持的类型（时间为ISO格式文本，空值为NULL）
+    @staticmethod
+    def _value(value):
+        if value is None or value is pd.NaT:
+            return None
+        if isinstance(value, pd.Timestamp):
+            return value.isoformat()
+        if isinstance(value, (np.integer, np.floating)):
+            value = value.item()
+        if isinstance(value, float) and np.isnan(value):
+            return None
+        return value
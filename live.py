@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chan.fractal import Fractal
+from chan.layer import Interval
+from chan.metrics import measure
+from chan.pivot import StrokePivot, SegmentPivot
+from chan.segment import Segment
+from chan.source import Period, Source
+from chan.stick import Stick
+from chan.stroke import Stroke
+from stockdata import IntervalConfig, StockData
+from wire import dumps
+
+logger = logging.getLogger("live")
+
+# 推送的各层数据列，与StockData.load的结果一致
+COLUMNS = {
+    'source': ['Date', 'Open', 'Close', 'Low', 'High', 'MACD', 'Signal', 'Histogram'],
+    'stick': ['Date', 'Low', 'High'],
+    'fractal': ['Date', 'Low', 'High'],
+    'stroke': ['Date', 'Low', 'High'],
+    'segment': ['Date', 'Low', 'High'],
+}
+
+
+# 一个(股票, 周期)的实时数据：从已保存的K线开始，定时从数据提供者获取新K线，增量更新各层，
+# 每次更新的变化（各层新确认的数据和尚未确认的尾部数据）只计算一次，推送给所有订阅者
+#   客户端处理方法：每层删除上次的尾部数据，追加新确认的数据，再追加新的尾部数据
+class LiveFeed:
+
+    def __init__(self, symbol, interval, provider=None):
+        self.symbol = symbol
+        self.interval = Interval(interval)
+        self.date_format = IntervalConfig[self.interval.name].value['format']
+
+        self.source = Source(symbol, provider)
+        stick = Stick(self.source)
+        fractal = Fractal(stick)
+        stroke = Stroke(fractal)
+        segment = Segment(stroke)
+        self.layers = {'stick': stick, 'fractal': fractal, 'stroke': stroke,
+                       'stroke_pivot': StrokePivot(stroke), 'segment': segment,
+                       'segment_pivot': SegmentPivot(segment)}
+
+        self.lock = threading.Lock()
+        self.started = False
+        self.version = 0
+        self.snapshots = {}
+        self.subscribers = set()
+        self.task = None
+
+    # 获取新K线并增量更新各层，返回变化（没有新K线时返回None），第一次时先处理已保存的K线
+    def step(self):
+        with self.lock:
+            if not self.started:
+                self._start()
+            # 只取最后一条K线，不合并完整数据集
+            data = self.source.get_rows(self.interval, max(self.source.get_confirmed(self.interval) - 1, 0))
+            with measure('live', self.interval.value, 'fetch') as sample:
+                if data is not None and len(data) > 0:
+                    bars = self.source._history(self.interval, start=data.index[-1])
+                else:
+                    # 没有已保存的K线时先下载全部数据
+                    data = None
+                    bars = self.source._history(self.interval, period=Period[self.interval.name].value)
+                sample.rows_out = len(bars) if bars is not None else 0
+            if bars is None or bars.empty or self._unchanged(data, bars):
+                return None
+            with measure('live', self.interval.value, 'update', len(bars)) as sample:
+                delta = self._update(bars)
+                sample.rows_out = sum(len(changes['confirmed']) + len(changes['tail'])
+                                      for name, changes in delta.items() if name != 'version')
+            return delta
+
+    # 只有最后一条K线且和已有的相同
+    @staticmethod
+    def _unchanged(data, bars):
+        if data is None or len(bars) > 1 or bars.index[-1] != data.index[-1]:
+            return False
+        columns = [column for column in ['Open', 'High', 'Low', 'Close', 'Volume'] if column in bars.columns]
+        return bars[columns].iloc[-1].equals(data[columns].iloc[-1])
+
+    # 当前全部数据（格式与变化相同，全部作为新确认的数据和尾部数据），同一版本只生成一次
+    def snapshot(self):
+        with self.lock:
+            if not self.started:
+                self._start()
+            snapshot = self.snapshots.get(self.version)
+            if snapshot is None:
+                snapshot = {'version': self.version}
+                for name, layer in [('source', self.source)] + list(self.layers.items()):
+                    data = layer.get_frame(self.interval)
+                    if data is None:
+                        continue
+                    count = layer.get_confirmed(self.interval)
+                    snapshot[name] = {'confirmed': self._rows(name, data.iloc[:count]),
+                                      'tail': self._rows(name, data.iloc[count:])}
+                self.snapshots = {self.version: snapshot}
+            return snapshot
+
+    # 从已保存的K线开始，所有数据都作为新K线增量处理一次
+    def _start(self):
+        bars = self.source._stored(self.interval)
+        self.source.data[self.interval.value] = None
+        if bars is not None and len(bars) > 0:
+            self._update(bars)
+        self.started = True
+
+    def _update(self, bars):
+        confirmed, tail = self.source.update(self.interval, bars)
+        delta = {'source': {'confirmed': self._rows('source', confirmed), 'tail': self._rows('source', tail)}}
+        for name, layer in self.layers.items():
+            confirmed, tail = layer.update(self.interval)
+            delta[name] = {'confirmed': self._rows(name, confirmed), 'tail': self._rows(name, tail)}
+        self.version += 1
+        delta['version'] = self.version
+        return delta
+
+    # 数据集转换为接口的行格式
+    def _rows(self, name, data):
+        if len(data) == 0:
+            return []
+        data = StockData.format_frame(data, self.date_format)
+        if name in COLUMNS:
+            return data[COLUMNS[name]].values.tolist()
+        return StockData.format_pivot_data(data).values.tolist()
+
+
+# 实时数据的订阅管理：同一(股票, 周期)的订阅者共用一个LiveFeed，有订阅者时在后台定时更新，没有订阅者时停止
+class LiveHub:
+
+    def __init__(self, provider=None, poll=30, workers=2):
+        self.provider = provider
+        self.poll = poll  # 获取新K线的间隔秒数
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='live')
+        self.feeds = {}
+
+    # 订阅一个(股票, 周期)的实时数据，先返回当前全部数据（snapshot），之后返回每次的变化（delta）
+    async def subscribe(self, symbol, interval):
+        key = (symbol, interval)
+        feed = self.feeds.get(key)
+        if feed is None:
+            feed = self.feeds[key] = LiveFeed(symbol, interval, self.provider)
+        queue = asyncio.Queue()
+        feed.subscribers.add(queue)
+        if feed.task is None:
+            feed.task = asyncio.create_task(self._run(feed))
+
+        loop = asyncio.get_running_loop()
+        try:
+            snapshot = await loop.run_in_executor(self.executor, feed.snapshot)
+            yield 'snapshot', snapshot
+            while True:
+                delta = await queue.get()
+                # 已经包含在全部数据中的变化不再发送
+                if delta['version'] > snapshot['version']:
+                    yield 'delta', delta
+        finally:
+            feed.subscribers.discard(queue)
+            if not feed.subscribers:
+                feed.task.cancel()
+                self.feeds.pop(key, None)
+
+    # 订阅者数量
+    def stats(self):
+        return {'feeds': len(self.feeds), 'subscribers': sum(len(feed.subscribers) for feed in self.feeds.values())}
+
+    async def _run(self, feed):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                delta = await loop.run_in_executor(self.executor, feed.step)
+            except Exception as e:
+                # 获取、更新时的异常已记录在测量结果中
+                logger.error(f"Error updating {feed.symbol} data for {feed.interval.value}: {e}")
+                delta = None
+            if delta is not None:
+                for queue in feed.subscribers:
+                    queue.put_nowait(delta)
+            await asyncio.sleep(self.poll)
+
+    # 转换为Server-Sent Events格式
+    @staticmethod
+    def event(name, data):
+        return f"event: {name}\ndata: {dumps(data).decode()}\n\n"
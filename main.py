@@ -1,18 +1,35 @@
+import os
+
 import uvicorn
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 from chan.layer import Interval
-from stockdata import IntervalConfig, StockData
+from chan.metrics import registry
+from live import LiveHub
+from screener import Screener
+from stockdata import IntervalConfig, StockDataCache, StockDataLoader
 from stocklist import StockList
+from viewport import Viewport
+from wire import WireFormat, dumps
 
 app = FastAPI()
+# 客户端支持时压缩响应（分钟数据的响应有几MB）
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 app.mount(path='/static',
           app=StaticFiles(directory='static'),
           name='static')
 templates = Jinja2Templates(directory='templates')
+cache = StockDataCache()
+# 同时计算的请求数量上限
+loader = StockDataLoader(cache, workers=int(os.getenv('CHAN_WORKERS', '4')))
+# 实时数据获取新K线的间隔秒数
+live = LiveHub(poll=int(os.getenv('CHAN_LIVE_POLL', '30')))
+screener = Screener(workers=int(os.getenv('CHAN_WORKERS', '4')))
 
 
 @app.get('/', response_class=HTMLResponse)
@@ -32,9 +49,59 @@ async def get_periods():
              'name': IntervalConfig[iv.name].value['name']} for iv in Interval]
 
 
+@app.get('/api/cache')
+async def get_cache():
+    return {**cache.stats(), **loader.stats(), **live.stats()}
+
+
+# 选股：所有已保存的股票中满足全部条件（where，可以有多个）的股票及其最新状态
+@app.get('/api/screen')
+async def get_screen(where: list[str] = Query(), interval: str = '1d',
+                     decline: int = Query(3, ge=1), rally: int = Query(3, ge=1)):
+    try:
+        table = await run_in_threadpool(screener.screen, interval, where, {'decline': decline, 'rally': rally})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=dumps(Screener.records(table)), media_type='application/json')
+
+
+# Prometheus格式的各层耗时、行数、字节数，以及缓存和计算队列的状态
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    stats = {**cache.stats(), **loader.stats(), **live.stats()}
+    gauges = {f'chan_{name}': value for name, value in stats.items()}
+    return registry.render(gauges)
+
+
+# 实时推送（Server-Sent Events）：先推送当前全部数据，之后推送每次更新的变化
+@app.get('/api/{symbol}/{interval}/live')
+async def get_live(symbol: str, interval: str):
+    # 周期在开始推送之前检查，推送开始后就不能再返回错误状态
+    try:
+        Interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        async for name, data in live.subscribe(symbol, interval):
+            yield LiveHub.event(name, data)
+
+    return StreamingResponse(events(), media_type='text/event-stream')
+
+
+# 按Accept头返回行格式（默认）、列格式JSON或列格式二进制
+# 可以只返回可见窗口（开始、结束时间或最后N根K线），点数超过points时合并K线，同时返回全部K线的概览
 @app.get('/api/{symbol}/{interval}')
-async def get_data(symbol: str, interval: str):
-    return StockData().load(symbol, interval)
+async def get_data(request: Request, symbol: str, interval: str,
+                   start: str | None = None, end: str | None = None,
+                   last: int | None = Query(None, ge=1), points: int | None = Query(None, ge=1)):
+    wire = WireFormat.negotiate(request.headers.get('accept'))
+    try:
+        viewport = Viewport(start, end, last, points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    content = await loader.load(symbol, interval, wire, viewport)
+    return Response(content=content, media_type=wire.value)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from chan.fractal import Fractal
+from chan.layer import Interval
+from chan.pivot import StrokePivot, SegmentPivot
+from chan.segment import Segment
+from chan.source import Source
+from chan.stick import Stick
+from chan.stroke import Stroke
+from chan.summary import SummaryIndex, UP, DOWN
+
+DATA = Path(__file__).parent / "data"
+
+# 选股条件：对所有股票的最新状态表按列计算，返回满足条件的行
+#   pivot_breakout：价格向上离开最后一个线段中枢
+#   pivot_breakdown：价格向下离开最后一个线段中枢
+#   bottom_after_decline：连续下跌至少decline笔后出现新的底分型
+#   top_after_rally：连续上涨至少rally笔后出现新的顶分型
+#   histogram_shrinking：最后一笔的MACD面积小于前一个同向笔
+PREDICATES = {
+    "pivot_breakout": lambda table, params: table["close"] > table["pivot_high"],
+    "pivot_breakdown": lambda table, params: table["close"] < table["pivot_low"],
+    "bottom_after_decline": lambda table, params: ((table["fractal"] == DOWN)
+                                                   & (table["fractal_date"] >= table["stroke_end"])
+                                                   & (table["stroke_direction"] == DOWN)
+                                                   & (table["decline"] >= int(params.get("decline", 3)))),
+    "top_after_rally": lambda table, params: ((table["fractal"] == UP)
+                                              & (table["fractal_date"] >= table["stroke_end"])
+                                              & (table["stroke_direction"] == UP)
+                                              & (table["rally"] >= int(params.get("rally", 3)))),
+    "histogram_shrinking": lambda table, params: table["stroke_area"] < table["previous_area"],
+}
+
+
+# 选股：读取最新状态汇总表，按条件筛选数据目录中的所有股票，汇总表中还没有的股票先从数据文件补上
+class Screener:
+
+    def __init__(self, workers=8, index=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='screener')
+        self.index = index or SummaryIndex.shared()
+
+    # 所有已保存数据的股票
+    @staticmethod
+    def universe():
+        if not DATA.exists():
+            return []
+        return sorted(path.name for path in DATA.iterdir() if path.is_dir() and any(path.glob("source_*")))
+
+    # 所有股票一个周期的最新状态表
+    def table(self, interval):
+        interval = Interval(interval)
+        universe = self.universe()
+        table = self.index.read(interval.value)
+        missing = set(universe) - set(table["symbol"])
+        if missing:
+            list(self.executor.map(lambda symbol: self.rebuild(symbol, [interval]), sorted(missing)))
+            table = self.index.read(interval.value)
+        # 汇总表中可能还有已经删除的股票
+        return table[table["symbol"].isin(universe)].reset_index(drop=True)
+
+    # 按条件选股（所有条件都满足），params为条件的参数
+    def screen(self, interval, predicates, params=None):
+        for predicate in predicates:
+            if predicate not in PREDICATES:
+                raise ValueError(f"Unknown predicate {predicate}")
+        table = self.table(interval)
+        if table.empty:
+            return table
+        mask = pd.Series(True, index=table.index)
+        for predicate in predicates:
+            mask &= PREDICATES[predicate](table, params or {}).fillna(False).astype(bool)
+        return table[mask]
+
+    # 从已保存的数据文件重新生成一个股票的汇总
+    def rebuild(self, symbol, intervals=Interval):
+        source = Source(symbol)
+        stick = Stick(source)
+        fractal = Fractal(stick)
+        stroke = Stroke(fractal)
+        segment = Segment(stroke)
+        for layer in [source, fractal, stroke, StrokePivot(stroke), segment, SegmentPivot(segment)]:
+            existing = [interval for interval in intervals if Path(layer.get_file_name(interval)).exists()]
+            if existing:
+                layer.load(existing)
+                self.index.update(layer)
+
+    # 结果转换为接口格式（时间转换为文本，空值为None）
+    @staticmethod
+    def records(table):
+        table = table.copy()
+        for column in table.columns:
+            if pd.api.types.is_datetime64_any_dtype(table[column]):
+                table[column] = table[column].dt.strftime('%Y-%m-%d %H:%M')
+        return table.astype(object).where(table.notna(), None).to_dict(orient='records')
+
+
+if __name__ == '__main__':
+    screener = Screener()
+    # 重新生成所有股票的汇总
+    for symbol in screener.universe():
+        screener.rebuild(symbol)
+    print(screener.screen(Interval.DAY_1.value, ["pivot_breakout"]))
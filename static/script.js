@@ -22,13 +22,42 @@ function hideLoading() {
     }
 }
 
+// 按列的二进制数据格式（见wire.py）
+const BINARY_FORMAT = 'application/vnd.chan.columns+octet-stream';
+
+// 二进制数据还原为每层一个行列表，时间位置换回时间，空值换回''，其他内容（如窗口信息）原样保留
+function decodeColumns(buffer) {
+    const headerLength = new DataView(buffer).getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+    let offset = 8 + headerLength;
+    const {dates, layers, ...data} = header;
+    for (const [name, layer] of Object.entries(layers)) {
+        const columns = layer.columns.map(([column, type]) => {
+            const values = type === 'int32'
+                ? new Int32Array(buffer, offset, layer.length)
+                : new Float64Array(buffer, offset, layer.length);
+            offset += Math.ceil(values.byteLength / 8) * 8;
+            return type === 'int32'
+                ? Array.from(values, index => dates[index])
+                : Array.from(values, value => Number.isNaN(value) ? '' : value);
+        });
+        data[name] = Array.from({length: layer.length}, (_, row) => columns.map(column => column[row]));
+    }
+    return data;
+}
+
 async function fetchData(symbol, interval) {
     try {
         showLoading();
-        const response = await fetch(`/api/${symbol}/${interval}`);
+        const response = await fetch(`/api/${symbol}/${interval}`, {
+            headers: {'Accept': `${BINARY_FORMAT}, application/json;q=0.5`}
+        });
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
+        if (response.headers.get('Content-Type') === BINARY_FORMAT) {
+            return decodeColumns(await response.arrayBuffer());
+        }
         return await response.json();
     } catch (error) {
         console.error("Failed to fetch data:", error);
@@ -1,14 +1,22 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
+import numpy as np
 import pandas as pd
 
 from chan.fractal import Fractal
 from chan.layer import Interval, Layer
+from chan.metrics import measure
 from chan.pivot import StrokePivot, SegmentPivot
 from chan.segment import Segment
 from chan.source import Source
 from chan.stick import Stick
 from chan.stroke import Stroke
+from viewport import Viewport
 
 Y_M_D_H_M = '%Y-%m-%d %H:%M'
 Y_M_D = '%Y-%m-%d'
@@ -45,15 +53,28 @@ class StockData:
         self.interval = Interval(interval)
         self.date_format = IntervalConfig[self.interval.name].value['format']
 
-        source_df = self._load_source()
-        self._load_stick(source_df)
-        self._load_fractal()
-        self._load_stroke()
-        self._load_stroke_pivot()
-        self._load_segment()
-        self._load_segment_pivot()
+        with measure("stockdata", interval, "load") as sample:
+            source_df = self._load_source()
+            self._load_stick(source_df)
+            self._load_fractal()
+            self._load_stroke()
+            self._load_stroke_pivot()
+            self._load_segment()
+            self._load_segment_pivot()
+            sample.rows_out = len(source_df) if source_df is not None else 0
         return self.data
 
+    # 一个周期用到的所有数据文件
+    @staticmethod
+    def file_names(symbol, interval):
+        source = Source(symbol)
+        stick = Stick(source)
+        fractal = Fractal(stick)
+        stroke = Stroke(fractal)
+        segment = Segment(stroke)
+        layers = [source, stick, fractal, stroke, StrokePivot(stroke), segment, SegmentPivot(segment)]
+        return [layer.get_file_name(Interval(interval)) for layer in layers]
+
     def _load_source(self):
         self.source = Source(self.symbol)
         source_df = self._load_layer_data(self.source)
@@ -67,13 +88,9 @@ class StockData:
         self.stick = Stick(self.source)
         stick_df = self._load_layer_data(self.stick)
         if stick_df is not None:
-            missing_dates = set(source_df['Date']) - set(stick_df['Date'])
-            missing_data = pd.DataFrame({'Date': list(missing_dates)})
-            for col in stick_df.columns:
-                if col != 'Date':
-                    missing_data[col] = ''
-            stick_df = pd.concat([stick_df, missing_data], ignore_index=True)
-            stick_df = stick_df.sort_values(by='Date').reset_index(drop=True)
+            # 合并后的K线按源数据的时间补齐空行
+            dates = source_df[['Date']].drop_duplicates()
+            stick_df = pd.merge(dates, stick_df, on='Date', how='outer', sort=True).fillna('')
             self.data['stick'] = stick_df[['Date', 'Low', 'High']].values.tolist()
 
     def _load_fractal(self):
@@ -92,7 +109,7 @@ class StockData:
         self.strokePivot = StrokePivot(self.stroke)
         pivot_df = self._load_layer_data(self.strokePivot)
         if pivot_df is not None:
-            self.data['stroke_pivot'] = self._format_pivot_data(pivot_df).values.tolist()
+            self.data['stroke_pivot'] = self.format_pivot_data(pivot_df).values.tolist()
 
     def _load_segment(self):
         self.segment = Segment(self.stroke)
@@ -105,28 +122,131 @@ class StockData:
         self.segmentPivot = SegmentPivot(self.segment)
         pivot_df = self._load_layer_data(self.segmentPivot)
         if pivot_df is not None:
-            self.data['segment_pivot'] = self._format_pivot_data(pivot_df).values.tolist()
+            self.data['segment_pivot'] = self.format_pivot_data(pivot_df).values.tolist()
 
     def _load_layer_data(self, layer: Layer):
-        layer.load_from_csv()
-        data = layer.get_data(self.interval).dropna(how='all').fillna('').reset_index()
-        if data is not None:
-            data['Date'] = pd.to_datetime(data['Date'], utc=True)
-            data['Date'] = data['Date'].dt.strftime(self.date_format)
+        layer.load([self.interval])
+        return self.format_frame(layer.get_frame(self.interval), self.date_format)
+
+    # 数据集转换为接口使用的格式（时间按周期的格式转换为文本，空值为''）
+    @staticmethod
+    def format_frame(df, date_format):
+        data = df.rename_axis('Date').dropna(how='all').fillna('').reset_index()
+        data['Date'] = pd.to_datetime(data['Date'], utc=True)
+        data['Date'] = data['Date'].dt.strftime(date_format)
         return data
 
+    # 中枢的起点和终点两行合并为一行（起点时间、终点时间、最高价、最低价）
+    @staticmethod
+    def format_pivot_data(pivot_df):
+        count = len(pivot_df) // 2 * 2
+        high = pd.to_numeric(pivot_df['High'], errors='coerce').to_numpy()[:count].reshape(-1, 2)
+        low = pd.to_numeric(pivot_df['Low'], errors='coerce').to_numpy()[:count].reshape(-1, 2)
+        date = pivot_df['Date'].to_numpy()[:count].reshape(-1, 2)
+        return pd.DataFrame({'Start': date[:, 0],
+                             'End': date[:, 1],
+                             'High': np.where(np.isnan(high[:, 0]), high[:, 1], high[:, 0]),
+                             'Low': np.where(np.isnan(low[:, 0]), low[:, 1], low[:, 0])})
+
+
+# 接口结果缓存，按(股票, 周期)缓存最终结果，底层数据文件变化后失效，超过容量时淘汰最久未使用的结果
+class StockDataCache:
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # 加载结果，可以只截取可见窗口，指定数据格式时返回编码后的响应内容（完整结果的每种格式、每种概览只计算一次）
+    def load(self, symbol, interval, wire=None, viewport=None):
+        key = (symbol, interval)
+        signature = self.signature(symbol, interval)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+
+        if entry is None:
+            entry = (signature, StockData().load(symbol, interval), {})
+            with self.lock:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+
+        memo = entry[2]
+        if viewport is not None and not viewport.is_full():
+            points = viewport.overview_points
+            overview = memo.get(('overview', points))
+            if overview is None:
+                overview = memo[('overview', points)] = Viewport.overview(entry[1], points)
+            data = viewport.apply(entry[1], overview)
+            return wire.encode(data) if wire is not None else data
+
+        if wire is None:
+            return entry[1]
+        encoded = memo.get(wire)
+        if encoded is None:
+            encoded = memo[wire] = wire.encode(entry[1])
+        return encoded
+
+    # 缓存统计
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'capacity': self.capacity,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # 底层数据文件的修改时间和大小
     @staticmethod
-    def _format_pivot_data(pivot_df):
-        pivot_df['High'] = pd.to_numeric(pivot_df['High'], errors='coerce')
-        pivot_df['Low'] = pd.to_numeric(pivot_df['Low'], errors='coerce')
-        df = pd.DataFrame(columns=['Start', 'End', 'Low', 'High'])
-        for index in range(0, len(pivot_df), 2):
-            start = pivot_df.iloc[index]
-            end = pivot_df.iloc[index + 1]
-            high = start['High'] if pd.notna(start['High']) else end['High']
-            low = start['Low'] if pd.notna(start['Low']) else end['Low']
-            df.loc[start.name] = [start['Date'], end['Date'], high, low]
-        return df
+    def signature(symbol, interval):
+        signature = []
+        for file_name in StockData.file_names(symbol, interval):
+            try:
+                stat = os.stat(file_name)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+
+# 异步加载，在线程池里计算，不阻塞事件循环；同一(股票, 周期)的并发请求合并为一次计算
+class StockDataLoader:
+
+    def __init__(self, cache, workers=4):
+        self.cache = cache
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stockdata')
+        self.pending = {}
+        self.coalesced = 0
+
+    async def load(self, symbol, interval, wire=None, viewport=None):
+        key = (symbol, interval, wire, viewport.key if viewport is not None else None)
+        future = self.pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self.cache.load, symbol, interval, wire, viewport)
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+            self.pending[key] = future
+        else:
+            self.coalesced += 1
+        # 一个请求被取消不影响其他等待同一结果的请求
+        return await asyncio.shield(future)
+
+    # 加载统计
+    def stats(self):
+        return {'workers': self.workers, 'pending': len(self.pending), 'coalesced': self.coalesced}
 
 
 if __name__ == '__main__':
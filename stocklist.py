@@ -1,7 +1,17 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+from chan.divergence import StrokeDivergence, SegmentDivergence, StrokePivotDivergence, SegmentPivotDivergence
 from chan.fractal import Fractal
+from chan.layer import Interval
+from chan.pipeline import Pipeline
 from chan.pivot import StrokePivot, SegmentPivot
+from chan.provider import Provider
 from chan.segment import Segment
-from chan.source import Source
+from chan.source import Period, Source, RESAMPLED_INTERVALS
 from chan.stick import Stick
 from chan.stroke import Stroke
 
@@ -12,26 +22,174 @@ class StockList:
         self.list = [{"symbol": "SQQQ", "name": "三倍做空纳指ETF-ProShares"},
                      {"symbol": "000001.SS", "name": "上证指数"}]
 
-    def download(self):
-        for stock in self.list:
-            self._download_data(stock['symbol'])
+    # 下载所有股票，按股票和时间周期拆分任务并行执行，返回每个任务的耗时统计
+    # （incremental只下载新增的K线，fused用融合流水线生成且只保存笔、线段和中枢，
+    #   resample由细周期K线合成粗周期K线，一个股票的所有周期在一个任务中先下载细周期再合成，
+    #   panel先在主进程中获取所有股票的K线，合并为长表一次计算MACD，任务中只生成各层，适合包含所有股票的本地大文件）
+    def download(self, workers=os.cpu_count(), pending=None, incremental=False, fused=False, resample=False,
+                 panel=False):
+        if panel and (incremental or resample):
+            raise ValueError("panel can not be combined with incremental or resample")
+        if resample:
+            groups = [",".join(interval.value for interval in Interval)]
+        else:
+            groups = [interval.value for interval in Interval]
+        tasks = [(stock['symbol'], group, incremental, fused, resample, panel)
+                 for stock in self.list for group in groups]
+        start = time.perf_counter()
+        # 本地大文件只读取一次，子进程共用
+        Provider.default().preload()
+        if panel:
+            self._prepare()
+        if workers is None or workers <= 1:
+            results = [self._download_interval(*task) for task in tasks]
+        else:
+            results = self._download_parallel(tasks, workers, pending or workers * 2)
+        self._report(results, time.perf_counter() - start)
+        return results
+
+    # 每个周期一次获取所有股票的K线并计算MACD，保存各股票的数据源
+    def _prepare(self):
+        sources = [Source(stock['symbol']) for stock in self.list]
+        for interval in Interval:
+            for source, bars in zip(sources, self.prepare_panel(sources, interval)):
+                source.data[interval.value] = bars
+        for source in sources:
+            source.save()
+
+    # 获取一个周期所有股票的K线，合并为长表按股票分组一次计算MACD，返回每个股票的K线（和逐个股票下载的结果一致）
+    @staticmethod
+    def prepare_panel(sources, interval):
+        frames = []
+        for source in sources:
+            try:
+                frames.append(source._history(interval, period=Period[interval.name].value))
+            except Exception as e:
+                print(f"Error fetching {source.symbol} data for {interval.value}: {e}")
+                frames.append(None)
+
+        # 长表统一使用UTC时间，拆分后换回每个股票原来的时区
+        filled = [(source.symbol, frame) for source, frame in zip(sources, frames)
+                  if frame is not None and not frame.empty]
+        if not filled:
+            return frames
+        panel = pd.concat([(frame.tz_convert("UTC") if frame.index.tz is not None else frame.tz_localize("UTC"))
+                           .assign(Symbol=symbol) for symbol, frame in filled])
+        panel = Source.prepare_panel(panel, interval)
+        groups = dict(list(panel.groupby("Symbol", sort=False)))
+
+        results = []
+        for source, frame in zip(sources, frames):
+            if frame is None or frame.empty:
+                results.append(frame)
+                continue
+            bars = groups.get(source.symbol, panel.iloc[:0]).drop(columns="Symbol").tz_convert(frame.index.tz)
+            results.append(source._filter(interval, bars))
+        return results
+
+    # 用进程池执行任务，同时提交的任务数量不超过pending
+    def _download_parallel(self, tasks, workers, pending):
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for task in tasks:
+                if len(futures) >= pending:
+                    results.extend(self._collect(futures, FIRST_COMPLETED))
+                futures[executor.submit(self._download_interval, *task)] = task
+            while futures:
+                results.extend(self._collect(futures, FIRST_COMPLETED))
+        return results
+
+    # 收集已经完成的任务结果（子进程异常退出也只记为该任务失败）
+    @staticmethod
+    def _collect(futures, return_when):
+        done, _ = wait(futures, return_when=return_when)
+        results = []
+        for future in done:
+            symbol, interval = futures.pop(future)[:2]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"symbol": symbol, "interval": interval, "seconds": 0.0,
+                                "layers": {}, "error": f"{type(e).__name__}: {e}"})
+        return results
+
+    # 下载并生成一个股票一个时间周期（多个周期用逗号分隔）的所有层数据，返回耗时统计
+    @staticmethod
+    def _download_interval(symbol, interval, incremental=False, fused=False, resample=False, panel=False):
+        result = {"symbol": symbol, "interval": interval, "seconds": 0.0, "layers": {}, "error": None}
+        start = time.perf_counter()
+        try:
+            intervals = [Interval(value) for value in interval.split(",")]
+            StockList._download_data(symbol, intervals, result["layers"], incremental, fused, resample, panel)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = time.perf_counter() - start
+        return result
 
     @staticmethod
-    def _download_data(symbol):
-        source = Source(symbol)
-        source.generate()
-        stick = Stick(source)
-        stick.generate()
-        fractal = Fractal(stick)
-        fractal.generate()
-        stroke = Stroke(fractal)
-        stroke.generate()
-        strokePivot = StrokePivot(stroke)
-        strokePivot.generate()
-        segment = Segment(stroke)
-        segment.generate()
-        segmentPivot = SegmentPivot(segment)
-        segmentPivot.generate()
+    def _download_data(symbol, intervals=Interval, timings=None, incremental=False, fused=False, resample=False,
+                       panel=False):
+        timings = {} if timings is None else timings
+
+        def generate(layer):
+            start = time.perf_counter()
+            if isinstance(layer, Source):
+                download(layer)
+            else:
+                layer.generate(intervals=intervals)
+            timings[layer.name] = time.perf_counter() - start
+            return layer
+
+        # 合成时先下载细周期，再由细周期合成粗周期（合成后一起保存），已经预处理时只加载数据源
+        def download(source):
+            if panel:
+                source.load(intervals)
+                return
+            coarse = [interval for interval in intervals if resample and interval in RESAMPLED_INTERVALS]
+            fine = [interval for interval in intervals if interval not in coarse]
+            if incremental:
+                source.fetch(auto_save=not coarse, intervals=fine)
+            else:
+                source.generate(auto_save=not coarse, intervals=fine)
+            if coarse:
+                source.resample(intervals=coarse)
+
+        source = generate(Source(symbol))
+        if fused:
+            pipeline = generate(Pipeline(source))
+            stroke, segment = pipeline.stroke, pipeline.segment
+        else:
+            stick = generate(Stick(source))
+            fractal = generate(Fractal(stick))
+            stroke = generate(Stroke(fractal))
+            generate(StrokePivot(stroke))
+            segment = generate(Segment(stroke))
+            generate(SegmentPivot(segment))
+        generate(StrokeDivergence(stroke))
+        generate(StrokePivotDivergence(stroke))
+        generate(SegmentDivergence(segment))
+        generate(SegmentPivotDivergence(segment))
+        return timings
+
+    # 打印耗时统计和失败的任务
+    @staticmethod
+    def _report(results, elapsed):
+        total = sum(result["seconds"] for result in results)
+        failed = [result for result in results if result["error"] is not None]
+        layers = {}
+        for result in results:
+            for name, seconds in result["layers"].items():
+                layers[name] = layers.get(name, 0.0) + seconds
+
+        print(f"Finished {len(results)} tasks, {len(failed)} failed, "
+              f"{elapsed:.2f}s elapsed, {total:.2f}s in tasks")
+        for name, seconds in sorted(layers.items(), key=lambda item: -item[1]):
+            print(f"  {name}: {seconds:.2f}s")
+        for result in sorted(results, key=lambda item: -item["seconds"])[:5]:
+            print(f"  slowest {result['symbol']} {result['interval']}: {result['seconds']:.2f}s")
+        for result in failed:
+            print(f"  failed {result['symbol']} {result['interval']}: {result['error']}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,410 @@
+import argparse
+import io
+import random
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmark import FREQUENCIES, generate_bars
+from chan.divergence import StrokeDivergence, SegmentDivergence, StrokePivotDivergence, SegmentPivotDivergence
+from chan.fractal import Fractal, FractalList
+from chan.layer import Interval
+from chan.pipeline import Pipeline
+from chan.pivot import StrokePivot, SegmentPivot
+from chan.provider import Provider
+from chan.segment import Segment
+from chan.source import Source, RESAMPLED_INTERVALS
+from chan.stick import Stick
+from chan.stroke import Stroke
+from chan.summary import SummaryIndex, _strokes
+from stocklist import StockList
+
+GOLDEN = Path(__file__).parent / "golden"
+
+LAYERS = ["stick", "fractal", "stroke", "strokepivot", "segment", "segmentpivot"]
+DIVERGENCES = ["strokedivergence", "strokepivotdivergence", "segmentdivergence", "segmentpivotdivergence"]
+
+
+# 生成模拟K线，价格保留两位小数（和真实数据一样会出现相同的最高价、最低价）
+def synthetic(kind, size, seed, interval=Interval.DAY_1):
+    bars = generate_bars(kind, size, seed, FREQUENCIES[interval])[["High", "Low"]].round(2)
+    return bars.tz_convert("Asia/Shanghai")
+
+
+# 真实数据脱敏：价格按第一根K线缩放到100附近，时间平移到2000年1月3日开始，只保留最高价、最低价
+def anonymize(data):
+    scale = 100 / data["High"].iloc[0]
+    index = pd.to_datetime(data.index, utc=True)
+    index = index - index[0] + pd.Timestamp("2000-01-03 01:30", tz="UTC")
+    return pd.DataFrame({"High": (data["High"] * scale).round(2).to_numpy(),
+                         "Low": (data["Low"] * scale).round(2).to_numpy()},
+                        index=index.tz_convert("Asia/Shanghai").rename("Date"))
+
+
+# 样本集（名称：周期和K线）：各种走势、各个周期的模拟数据，足够产生线段中枢的长数据，加上容易出错的边界数据
+def corpus():
+    cases = {}
+    for kind in ["walk", "trend", "choppy"]:
+        for number, interval in enumerate(Interval):
+            cases[f"{kind}_{interval.value}"] = (interval, synthetic(kind, 400, number, interval))
+    for kind, interval in [("walk", Interval.MIN_5), ("trend", Interval.HOUR_1), ("choppy", Interval.DAY_1)]:
+        cases[f"long_{kind}_{interval.value}"] = (interval, synthetic(kind, 4000, 3, interval))
+    for size in [0, 1, 2, 3, 5, 8]:
+        cases[f"short_{size}"] = (Interval.DAY_1, synthetic("walk", size, size))
+    index = pd.date_range("2000-01-03", periods=12, freq="B", tz="Asia/Shanghai", name="Date")
+    cases["inside"] = (Interval.DAY_1, pd.DataFrame({"High": 20.0 - np.arange(12), "Low": 1.0 + np.arange(12)},
+                                                    index=index))
+    cases["flat"] = (Interval.DAY_1, pd.DataFrame({"High": np.full(12, 10.0), "Low": np.full(12, 9.0)}, index=index))
+    return cases
+
+
+# 样本只有最高价、最低价，开盘价取最低价、收盘价取最高价计算MACD（背驰需要柱状图）
+def with_macd(bars):
+    return Source.calculate_macd(bars.assign(Open=bars["Low"], Close=bars["High"], Volume=0))
+
+
+# 数据源和各层（笔、线段之后是中枢和背驰）
+def build_layers(symbol, bars, interval):
+    source = Source(symbol)
+    if bars is not None:
+        source.data[interval.value] = with_macd(bars)
+    stick = Stick(source)
+    fractal = Fractal(stick)
+    stroke = Stroke(fractal)
+    segment = Segment(stroke)
+    return source, [stick, fractal, stroke, StrokePivot(stroke), segment, SegmentPivot(segment),
+                    StrokeDivergence(stroke), StrokePivotDivergence(stroke),
+                    SegmentDivergence(segment), SegmentPivotDivergence(segment)]
+
+
+# 依次生成各层的数据
+def run_layers(bars, interval):
+    _, layers = build_layers("GOLDEN", bars, interval)
+    for layer in layers:
+        layer.generate(auto_save=False, intervals=[interval])
+    return {layer.name: layer.get_frame(interval) for layer in layers}
+
+
+# 用各层的逐行参考实现（原有的逐行算法）依次生成各层的数据，作为样本集的期望输出
+def reference_layers(bars, interval):
+    source, layers = build_layers("REFERENCE", bars, interval)
+    outputs = {}
+    for layer in layers:
+        data = source.get_data(interval) if layer.parent is source else outputs[layer.parent.name]
+        outputs[layer.name] = layer.generate_interval_by_row(interval, data)
+    return outputs
+
+
+def to_csv(data):
+    buffer = io.StringIO()
+    data.to_csv(buffer, index_label="Date")
+    return buffer.getvalue()
+
+
+def read_csv(file_name):
+    return pd.read_csv(file_name, index_col=0, parse_dates=True, float_precision="round_trip")
+
+
+# 样本的周期和输入（文件名和数据目录一致，为source_周期.csv）
+def read_case(folder):
+    file_name = next(folder.glob("source_*.csv"))
+    return Interval(file_name.stem.split("_", 1)[1]), read_csv(file_name)
+
+
+# 找到第一个不同的行，返回说明（相同时返回None）
+def first_difference(expected, actual):
+    expected, actual = expected.splitlines(), actual.splitlines()
+    for row, (left, right) in enumerate(zip(expected, actual)):
+        if left != right:
+            return f"row {row}: expected {left!r}, got {right!r}"
+    if len(expected) != len(actual):
+        row = min(len(expected), len(actual))
+        extra = expected[row] if len(expected) > row else actual[row]
+        return f"row {row}: expected {len(expected) - 1} rows, got {len(actual) - 1} rows (first extra {extra!r})"
+    return None
+
+
+# 生成样本集的输入，期望输出由逐行参考实现生成（不依赖被校验的加速实现）
+def freeze(cases=None):
+    if cases is None:
+        # 已加入的真实数据保留输入，只重新生成期望输出
+        cases = corpus()
+        for folder in GOLDEN.glob("real_*"):
+            cases[folder.name] = read_case(folder)
+    for name, (interval, bars) in cases.items():
+        folder = GOLDEN / name
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True)
+        (folder / f"source_{interval.value}.csv").write_text(to_csv(bars))
+        # 期望输出由读回的输入生成，和校验时一致
+        for layer, data in reference_layers(*reversed(read_case(folder))).items():
+            (folder / f"{layer}_{interval.value}.csv").write_text(to_csv(data))
+    print(f"Froze {len(cases)} cases in {GOLDEN}")
+
+
+# 用样本集校验当前实现，返回失败的数量
+def check():
+    failures = 0
+    folders = sorted(path for path in GOLDEN.iterdir() if path.is_dir())
+    for folder in folders:
+        interval, bars = read_case(folder)
+        outputs = run_layers(bars, interval)
+        for layer in LAYERS + DIVERGENCES:
+            expected = (folder / f"{layer}_{interval.value}.csv").read_text()
+            difference = first_difference(expected, to_csv(outputs[layer]))
+            if difference is not None:
+                failures += 1
+                print(f"FAIL {folder.name} {layer}: {difference}")
+    print(f"Checked {len(folders)} golden cases, {failures} failures")
+    return failures
+
+
+# 参考实现和加速实现的成对比较（名称、参考结果、加速结果）
+def differentials(bars, interval, rng):
+    # 每一层的逐行参考实现和加速实现使用相同的输入（上一层的加速实现的结果，参考实现使用转换后的数据集）
+    source, layers = build_layers("DIFF", bars, interval)
+    outputs = {source.name: source.get_data(interval)}
+    for layer in layers:
+        data = outputs[layer.parent.name]
+        outputs[layer.name] = layer.generate_interval(interval, data)
+        yield (layer.name, layer.generate_interval_by_row(interval, layer.parent._as_frame(data)),
+               layer._as_frame(outputs[layer.name]))
+
+    # 融合流水线、增量更新和逐层生成的结果一致
+    layered = run_layers(bars, interval)
+    source = Source("DIFF")
+    source.data[interval.value] = bars
+    pipeline = Pipeline(source, keep=LAYERS, batch=rng.choice([1, 7, 64, 10000]))
+    pipeline.generate(auto_save=False, intervals=[interval])
+    for layer in pipeline.layers:
+        yield f"pipeline {layer.name}", layered[layer.name], layer.get_frame(interval)
+
+    for name, data in streamed(bars, interval, rng).items():
+        yield f"update {name}", layered[name], data
+
+
+# 随机分批增量更新所有层，第一次只更新3根K线（上层都还没有数据）
+def streamed(bars, interval, rng):
+    source, layers = build_layers("DIFF", None, interval)
+    bars = bars.assign(Open=bars["Low"], Close=bars["High"], Volume=0)
+    position = 0
+    while position < len(bars):
+        step = rng.choice([1, 1, 2, 5, 17, 100]) if position > 0 else 3
+        source.update(interval, bars.iloc[position:position + step])
+        for layer in layers:
+            layer.update(interval)
+        position += step
+    # 没有输入时各层都没有数据
+    return {layer.name: layer.get_frame(interval) if position > 0 else layer._to_frame([]) for layer in layers}
+
+
+# 数据提供者没有数据时返回没有列的空数据集：融合流水线和逐层生成都得到各层的空数据集
+def empty_source():
+    source, layers = build_layers("EMPTY", None, Interval.DAY_1)
+    source.data[Interval.DAY_1.value] = pd.DataFrame()
+    layers = layers[:len(LAYERS)]
+    for layer in layers:
+        layer.generate(auto_save=False, intervals=[Interval.DAY_1])
+
+    fused = Source("EMPTY")
+    fused.data[Interval.DAY_1.value] = pd.DataFrame()
+    pipeline = Pipeline(fused, keep=LAYERS)
+    pipeline.generate(auto_save=False, intervals=[Interval.DAY_1])
+    for expected, actual in zip(layers, pipeline.layers):
+        yield f"empty {actual.name}", expected.get_frame(Interval.DAY_1), actual.get_frame(Interval.DAY_1)
+
+
+# 固定数据的数据提供者（每个周期一个数据集），忽略时间范围，总是返回全部历史（可以指定开始时间），记录每次请求
+class StubProvider(Provider):
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.calls = []
+
+    def history(self, symbol, interval, period=None, start=None):
+        self.calls.append((interval, period, start))
+        df = self.frames.get(interval)
+        if df is None:
+            return pd.DataFrame()
+        return self._slice(df, start=start)
+
+
+# 美股交易时段的1分钟K线（跨越月份、夏令时切换），粗周期K线和交易所一样从开盘时间对齐汇总
+def minute_frames(days=30, seed=0):
+    dates = pd.bdate_range("2024-02-20", periods=days)
+    index = pd.DatetimeIndex([date + pd.Timedelta(minutes=9 * 60 + 30 + minute)
+                              for date in dates for minute in range(390)]).tz_localize("America/New_York")
+    bars = generate_bars("walk", len(index), seed).round(2).drop(columns=["MACD", "Signal", "Histogram"])
+    bars = bars.set_axis(index.rename("Date"))
+    rules = {Interval.MIN_30: {"rule": "30min"}, Interval.HOUR_1: {"rule": "1h", "offset": "30min"},
+             Interval.DAY_1: {"rule": "D"}, Interval.WEEK_1: {"rule": "W-MON", "label": "left", "closed": "left"},
+             Interval.MONTH_1: {"rule": "MS"}}
+    frames = {Interval.MIN_1: bars}
+    for interval, rule in rules.items():
+        frames[interval] = bars.resample(**rule).agg(
+            {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}).dropna()
+    return frames
+
+
+# 接着计算的MACD、从文件读回的价格和整体计算只有浮点误差
+def rounded(data):
+    return data.round(9)
+
+
+# 由1分钟K线合成的粗周期K线（包括MACD）和直接下载的一致（合成时下载的粗周期只有前两根K线，第一根之后都由合成得到）
+def resampled():
+    frames = minute_frames()
+    fetched = Source("RESAMPLE", StubProvider(frames))
+    fetched.generate(auto_save=False, intervals=RESAMPLED_INTERVALS)
+    first = {interval: data.iloc[:2] if interval in RESAMPLED_INTERVALS else data for interval, data in frames.items()}
+    source = Source("RESAMPLE", StubProvider(first))
+    source.generate(auto_save=False, intervals=[Interval.MIN_1])
+    source.resample(auto_save=False)
+    for interval in RESAMPLED_INTERVALS:
+        yield (f"resample {interval.value}", rounded(fetched.get_data(interval)),
+               rounded(source.get_data(interval)))
+
+
+# 多个股票合并为长表一次计算MACD，和逐个股票计算一致（A股分钟线去掉非交易时段，没有数据、只有一根K线的股票）
+def panels():
+    columns = ["MACD", "Signal", "Histogram"]
+    us = {Interval.MIN_1: minute_frames()[Interval.MIN_1],
+          Interval.DAY_1: generate_bars("walk", 300, 1, "B").drop(columns=columns)}
+    index = pd.date_range("2024-03-01 01:00", periods=3 * 24 * 60, freq="1min", tz="UTC", name="Date")
+    cn = {Interval.MIN_1: generate_bars("trend", len(index), 2).drop(columns=columns).set_axis(index),
+          Interval.DAY_1: generate_bars("choppy", 200, 3, "B").drop(columns=columns).tz_convert("Asia/Shanghai")}
+    sources = [Source("US", StubProvider(us)), Source("CN.SS", StubProvider(cn)), Source("NONE", StubProvider({})),
+               Source("ONE", StubProvider({Interval.DAY_1: us[Interval.DAY_1].iloc[:1]}))]
+    for interval in [Interval.MIN_1, Interval.DAY_1]:
+        for source, actual in zip(sources, StockList.prepare_panel(sources, interval)):
+            bars = source._history(interval)
+            expected = bars if bars.empty else Source.calculate_macd(source._filter(interval, bars.copy()))
+            yield f"panel {source.symbol} {interval.value}", expected, actual
+
+
+# 汇总表中最后一笔和前一个同向笔的MACD面积和背驰使用的面积一致
+def summary_areas():
+    for kind in ["walk", "trend", "choppy"]:
+        source, layers = build_layers("AREA", synthetic(kind, 1000, 7), Interval.DAY_1)
+        stroke = layers[2]
+        for layer in layers[:3]:
+            layer.generate(auto_save=False, intervals=[Interval.DAY_1])
+        data = stroke.get_frame(Interval.DAY_1)
+        _, _, area = StrokeDivergence(stroke)._areas(Interval.DAY_1, FractalList.of(data))
+        summary = _strokes(data.set_axis(pd.to_datetime(data.index, utc=True)),
+                           *SummaryIndex._source(stroke, Interval.DAY_1.value))
+        yield (f"summary area {kind}", pd.DataFrame({"Area": area[[-1, -3]]}),
+               pd.DataFrame({"Area": [summary["stroke_area"], summary["previous_area"]]}))
+
+
+# 增量下载只请求最后一条K线之后的数据，接着保存的指数平均值（.ema.json）计算MACD，和整体重新计算一致
+def continued():
+    bars = generate_bars("trend", 600, 4, "B").drop(columns=["MACD", "Signal", "Histogram"])
+    # 保存时最后一条K线还没有结束，之后价格还会变化
+    stored = bars.iloc[:400].copy()
+    stored.iloc[-1, stored.columns.get_loc("Close")] -= 0.5
+    provider = StubProvider({Interval.DAY_1: stored})
+    folder = Path(tempfile.mkdtemp())
+    try:
+        source = Source("CONTINUE", provider)
+        source.path = folder
+        source.generate(auto_save=False, intervals=[Interval.DAY_1])
+        source._save(source.storage)
+        yield "ema saved", ema_states(stored), saved_states(source)
+
+        # 新的数据源对象只有保存的文件，指数平均值从.ema.json读取
+        provider.frames[Interval.DAY_1] = bars
+        provider.calls.clear()
+        source = Source("CONTINUE", provider)
+        source.path = folder
+        source.fetch(auto_save=False, intervals=[Interval.DAY_1])
+        yield ("fetch request", pd.DataFrame({"Start": pd.to_datetime([stored.index[-1]], utc=True)}),
+               pd.DataFrame({"Start": pd.to_datetime([start for _, _, start in provider.calls], utc=True)}))
+        yield "fetch macd", rounded(Source.calculate_macd(bars.copy())), rounded(source.get_data(Interval.DAY_1))
+        source._save(source.storage)
+        yield "ema fetched", ema_states(bars), saved_states(source)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# 指数平均值比较时保留的小数位数
+ROUNDING = {"fast": 9, "slow": 9, "signal": 9}
+
+
+# 整体计算的最后两条K线的指数平均值（时间、快线、慢线、信号线）
+def ema_states(bars):
+    data = Source.calculate_macd(bars.copy())
+    return pd.DataFrame({"date": data.index[-2:].tz_convert("UTC"),
+                         "fast": data["Close"].ewm(span=12, adjust=False).mean().iloc[-2:].to_numpy(),
+                         "slow": data["Close"].ewm(span=26, adjust=False).mean().iloc[-2:].to_numpy(),
+                         "signal": data["Signal"].iloc[-2:].to_numpy()}).round(ROUNDING)
+
+
+# 和数据一起保存的指数平均值
+def saved_states(source):
+    states = pd.DataFrame(source._read_ema(Interval.DAY_1))
+    if not states.empty:
+        states["date"] = pd.to_datetime(states["date"], utc=True)
+    return states.round(ROUNDING)
+
+
+# 固定场景的成对比较，返回失败的数量
+def scenarios():
+    failures = count = 0
+    for name, expected, actual in [*empty_source(), *resampled(), *panels(), *summary_areas(), *continued()]:
+        count += 1
+        difference = first_difference(to_csv(expected), to_csv(actual))
+        if difference is not None:
+            failures += 1
+            print(f"FAIL {name}: {difference}")
+    print(f"Checked {count} scenario outputs, {failures} failures")
+    return failures
+
+
+# 随机输入的差分测试，返回失败的数量
+def fuzz(count, seed=0):
+    rng = random.Random(seed)
+    failures = 0
+    for number in range(count):
+        kind = rng.choice(["walk", "trend", "choppy"])
+        size = rng.choice([0, 3, 7, 30, 200, 1000, 2000])
+        interval = rng.choice(list(Interval))
+        bars = synthetic(kind, size, rng.randrange(1 << 30), interval)
+        if rng.random() < 0.3:
+            # 价格取整，制造更多相同的最高价、最低价
+            bars = bars.round(0)
+        for name, expected, actual in differentials(bars, interval, rng):
+            difference = first_difference(to_csv(expected), to_csv(actual))
+            if difference is not None:
+                failures += 1
+                print(f"FAIL #{number} {kind} {size} {interval.value} {name}: {difference}")
+    print(f"Fuzzed {count} inputs, {failures} failures")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="缠论各层结果校验")
+    parser.add_argument("--freeze", action="store_true", help="重新生成样本集的期望输出")
+    parser.add_argument("--add", metavar="FILE", help="脱敏后加入一个真实数据文件（CSV，包含High、Low列）")
+    parser.add_argument("--interval", default=Interval.DAY_1.value, choices=[interval.value for interval in Interval],
+                        help="加入的真实数据的周期")
+    parser.add_argument("--fuzz", type=int, default=50, help="随机差分测试的次数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.freeze:
+        freeze()
+    elif args.add:
+        interval = Interval(args.interval)
+        freeze({f"real_{Path(args.add).stem}": (interval, anonymize(read_csv(args.add)))})
+    else:
+        failures = check() + scenarios() + fuzz(args.fuzz, args.seed)
+        if failures:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import pandas as pd
+
+# 没有指定点数时概览的点数
+OVERVIEW = 500
+# 概览的点数档位（按不小于请求点数的档位计算和缓存，超过最大档位时取最大档位）
+OVERVIEW_SIZES = [64, 128, 256, 512, 1024, 2048, 4096]
+
+
+# 图表的可见窗口：按时间（开始、结束）或最后N根K线截取，点数超过目标时按区间合并K线（保留最高、最低价）
+#   笔、线段在窗口边界处按位置线性插值截断，中枢截取与窗口相交的部分
+class Viewport:
+
+    def __init__(self, start=None, end=None, last=None, points=None):
+        self.start = self._parse(start)
+        self.end = self._parse(end, True)
+        self.last = last
+        self.points = points
+
+    # 是否需要截取（都没有指定时返回全部数据）
+    def is_full(self):
+        return self.start is None and self.end is None and self.last is None and self.points is None
+
+    # 用于合并相同请求
+    @property
+    def key(self):
+        return self.start, self.end, self.last, self.points
+
+    # 概览的点数（固定的几个档位之一）
+    @property
+    def overview_points(self):
+        if self.points is None:
+            return OVERVIEW
+        return next((size for size in OVERVIEW_SIZES if size >= self.points), OVERVIEW_SIZES[-1])
+
+    # 截取StockData.load的结果，overview为全部数据的概览
+    def apply(self, data, overview):
+        source = data.get('source', [])
+        dates = np.asarray([row[0] for row in source], dtype=str)
+        low, high = self._bounds(dates.tolist())
+        buckets = Buckets(low, high, self.points)
+        labels = dates[buckets.starts].tolist()
+
+        result = {'source': buckets.bars(source[low:high])}
+        if 'stick' in data:
+            result['stick'] = buckets.sticks(data['stick'], dates, labels)
+        if 'fractal' in data:
+            result['fractal'] = buckets.points(data['fractal'], dates, labels)
+        for name in ['stroke', 'segment']:
+            if name in data:
+                result[name] = buckets.lines(data[name], dates, labels)
+        for name in ['stroke_pivot', 'segment_pivot']:
+            if name in data:
+                result[name] = buckets.pivots(data[name], dates, labels)
+        result['overview'] = overview
+        result['window'] = {'total': len(source), 'start': low, 'end': high, 'points': len(labels)}
+        return result
+
+    # 窗口在源数据中的位置范围[low, high)，结束时间包含以它开头的所有时间（如结束日期包含当天的分钟K线）
+    def _bounds(self, dates):
+        low = bisect_left(dates, self.start) if self.start is not None else 0
+        high = bisect_right(dates, self.end + '\uffff') if self.end is not None else len(dates)
+        if self.last is not None:
+            low = max(low, high - self.last)
+        return low, max(low, high)
+
+    # 全部K线的概览
+    @staticmethod
+    def overview(data, points=None):
+        source = data.get('source', [])
+        return Buckets(0, len(source), points or OVERVIEW).bars(source)
+
+    # 解析时间参数，转换为和数据相同格式的UTC时间文本，格式错误时抛出ValueError
+    #   零点的开始时间只保留日期（包含当天的日K线），结束时间只有指定日期时才只保留日期（包含当天的所有时间）
+    @staticmethod
+    def _parse(value, end=False):
+        if value is None:
+            return None
+        try:
+            timestamp = pd.Timestamp(value)
+        except (TypeError, ValueError):
+            timestamp = pd.NaT
+        if pd.isna(timestamp):
+            raise ValueError(f"Invalid time: {value!r}")
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+        if timestamp == timestamp.normalize() and (not end or len(value.strip()) <= 10):
+            return timestamp.strftime('%Y-%m-%d')
+        return timestamp.strftime('%Y-%m-%d %H:%M')
+
+
+# 把源数据位置范围[low, high)平均分为不超过points个区间，每个区间合并为一个点（以区间第一根K线的时间为准）
+class Buckets:
+
+    def __init__(self, low, high, points=None):
+        self.low = low
+        self.high = high
+        count = high - low
+        if points is None or count <= points:
+            self.starts = np.arange(low, high)
+        else:
+            self.starts = low + np.unique(np.arange(count) * points // count, return_index=True)[1]
+
+    # 源数据位置所在的区间
+    def _bucket(self, positions):
+        return np.searchsorted(self.starts, positions, side='right') - 1
+
+    # 合并K线：开盘价取第一根，收盘价、MACD、信号线取最后一根，最低、最高价取最小、最大值，柱状图取绝对值最大的值
+    def bars(self, rows):
+        if len(rows) == 0:
+            return []
+        frame = _numeric(rows, 8)
+        starts = self.starts - self.low
+        ends = np.append(starts[1:], len(rows)) - 1
+        date = np.asarray([row[0] for row in rows], dtype=object)[starts]
+        histogram_max = np.fmax.reduceat(frame[7], starts)
+        histogram_min = np.fmin.reduceat(frame[7], starts)
+        columns = [date,
+                   frame[1][starts],
+                   frame[2][ends],
+                   np.fmin.reduceat(frame[3], starts),
+                   np.fmax.reduceat(frame[4], starts),
+                   frame[5][ends],
+                   frame[6][ends],
+                   np.where(np.abs(histogram_min) > np.abs(histogram_max), histogram_min, histogram_max)]
+        return _rows(columns)
+
+    # 合并K线（与源数据逐行对应）：最低、最高价取区间的最小、最大值
+    def sticks(self, rows, dates, labels):
+        positions, frame = self._locate(rows, dates, 3)
+        inside = (positions >= self.low) & (positions < self.high)
+        bucket = self._bucket(positions[inside])
+        low = np.full(len(labels), np.nan)
+        high = np.full(len(labels), np.nan)
+        np.fmin.at(low, bucket, frame[1][inside])
+        np.fmax.at(high, bucket, frame[2][inside])
+        return _rows([np.asarray(labels, dtype=object), low, high])
+
+    # 分型：窗口内的点，时间换为所在区间的时间
+    def points(self, rows, dates, labels):
+        positions, frame = self._locate(rows, dates, 3)
+        inside = (positions >= self.low) & (positions < self.high)
+        label = np.asarray(labels, dtype=object)[self._bucket(positions[inside])]
+        return _rows([label, frame[1][inside], frame[2][inside]])
+
+    # 笔、线段：窗口内的端点，穿过窗口边界的部分在边界处插值
+    def lines(self, rows, dates, labels):
+        positions, frame = self._locate(rows, dates, 3)
+        if len(positions) == 0 or self.high <= self.low:
+            return []
+        values = np.where(np.isnan(frame[1]), frame[2], frame[1])
+        first, last = self.low, self.high - 1
+        inside = np.flatnonzero((positions >= first) & (positions <= last))
+
+        result = _rows([np.asarray(labels, dtype=object)[self._bucket(positions[inside])],
+                        frame[1][inside], frame[2][inside]])
+        # 与窗口相交的第一笔和最后一笔
+        before = np.searchsorted(positions, first, side='left')
+        after = np.searchsorted(positions, last, side='right')
+        if 0 < before < len(positions) and positions[before] > first:
+            value = np.interp(first, positions[before - 1:before + 1], values[before - 1:before + 1])
+            result.insert(0, [labels[0], float(value), float(value)])
+        if 0 < after < len(positions) and positions[after - 1] < last:
+            value = np.interp(last, positions[after - 1:after + 1], values[after - 1:after + 1])
+            result.append([labels[-1], float(value), float(value)])
+        return result
+
+    # 中枢：与窗口相交的中枢，起止时间截取到窗口内
+    def pivots(self, rows, dates, labels):
+        if len(rows) == 0 or self.high <= self.low:
+            return []
+        start = np.searchsorted(dates, [row[0] for row in rows])
+        end = np.searchsorted(dates, [row[1] for row in rows])
+        inside = (end >= self.low) & (start < self.high)
+        label = np.asarray(labels, dtype=object)
+        start = label[self._bucket(np.clip(start[inside], self.low, self.high - 1))]
+        end = label[self._bucket(np.clip(end[inside], self.low, self.high - 1))]
+        return [[start[number], end[number], *rows[index][2:]]
+                for number, index in enumerate(np.flatnonzero(inside))]
+
+    # 数据行在源数据中的位置和数值列
+    @staticmethod
+    def _locate(rows, dates, width):
+        positions = np.searchsorted(dates, [row[0] for row in rows]) if len(rows) > 0 else np.array([], dtype=int)
+        return positions, _numeric(rows, width)
+
+
+# 数据行转换为按列的浮点数组（空值为NaN）
+def _numeric(rows, width):
+    frame = pd.DataFrame(rows, columns=range(width))
+    return [frame[0].to_numpy()] + [pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype=float)
+                                    for column in range(1, width)]
+
+
+# 按列的数组转换回数据行（NaN换回''）
+def _rows(columns):
+    frame = pd.DataFrame({number: column for number, column in enumerate(columns)})
+    return frame.astype(object).where(frame.notna(), '').values.tolist()
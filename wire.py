@@ -0,0 +1,114 @@
+import json
+import struct
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 各层数据行的列（时间列、数值列），与StockData.load的结果一致
+LAYOUT = {
+    'source': (['Date'], ['Open', 'Close', 'Low', 'High', 'MACD', 'Signal', 'Histogram']),
+    'stick': (['Date'], ['Low', 'High']),
+    'fractal': (['Date'], ['Low', 'High']),
+    'stroke': (['Date'], ['Low', 'High']),
+    'stroke_pivot': (['Start', 'End'], ['High', 'Low']),
+    'segment': (['Date'], ['Low', 'High']),
+    'segment_pivot': (['Start', 'End'], ['High', 'Low']),
+    'overview': (['Date'], ['Open', 'Close', 'Low', 'High', 'MACD', 'Signal', 'Histogram']),
+}
+
+MAGIC = b'CHAN'
+
+
+# 接口数据格式，按请求的Accept头选择
+#   ROWS：每层一个行列表（原格式）
+#   COLUMNS：按列的JSON，所有层共用一个时间数组，时间列为时间数组中的位置，空值为null
+#   BINARY：按列的二进制格式，时间数组和列说明放在JSON头中，之后是int32位置和float64数值
+class WireFormat(Enum):
+    ROWS = 'application/json'
+    COLUMNS = 'application/vnd.chan.columns+json'
+    BINARY = 'application/vnd.chan.columns+octet-stream'
+
+    # 按Accept头（忽略q值，按出现顺序）选择格式，都不支持时使用原格式
+    @staticmethod
+    def negotiate(accept):
+        for media_type in (accept or '').split(','):
+            media_type = media_type.split(';')[0].strip()
+            for wire in WireFormat:
+                if wire.value == media_type:
+                    return wire
+        return WireFormat.ROWS
+
+    # 把StockData.load的结果编码为响应内容
+    def encode(self, data):
+        if self is WireFormat.ROWS:
+            return dumps(data)
+        columns = to_columns(data)
+        if self is WireFormat.COLUMNS:
+            return dumps(columns)
+        return pack(columns)
+
+
+# JSON序列化（安装了orjson时使用orjson，NaN输出为null）
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=_plain, separators=(',', ':')).encode()
+
+
+# 标准json库不支持的NumPy数组和NaN
+def _plain(value):
+    if isinstance(value, np.ndarray):
+        return [None if isinstance(item, float) and np.isnan(item) else item for item in value.tolist()]
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# 行格式转换为列格式（共用的时间数组 + 每层的时间位置和数值列），其他内容（如窗口信息）原样保留
+def to_columns(data):
+    frames = {name: pd.DataFrame(rows, columns=LAYOUT[name][0] + LAYOUT[name][1])
+              for name, rows in data.items() if name in LAYOUT}
+    dates = [frame[column].to_numpy(dtype=str) for name, frame in frames.items() for column in LAYOUT[name][0]]
+    # 时间格式是定长的，按文本排序就是按时间排序
+    dates = np.unique(np.concatenate(dates)) if dates else np.array([], dtype=str)
+
+    columns = {'dates': dates.tolist()}
+    for name, frame in frames.items():
+        date_columns, value_columns = LAYOUT[name]
+        layer = {}
+        for column in date_columns:
+            layer[column] = np.searchsorted(dates, frame[column].to_numpy(dtype=str)).astype(np.int32)
+        for column in value_columns:
+            layer[column] = pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype=np.float64)
+        columns[name] = layer
+    for name, value in data.items():
+        if name not in LAYOUT:
+            columns[name] = value
+    return columns
+
+
+# 列格式打包为二进制：'CHAN'、JSON头长度（uint32）、JSON头（时间数组、列说明和其他内容）、各列数组，每段按8字节对齐
+def pack(columns):
+    header = {'dates': columns['dates'], 'layers': {}}
+    arrays = []
+    for name, layer in columns.items():
+        if name not in LAYOUT:
+            header.setdefault(name, layer)
+            continue
+        header['layers'][name] = {
+            'length': len(next(iter(layer.values()))),
+            'columns': [[column, values.dtype.name] for column, values in layer.items()],
+        }
+        arrays.extend(layer.values())
+
+    head = json.dumps(header, separators=(',', ':')).encode()
+    head += b' ' * (-(len(MAGIC) + 4 + len(head)) % 8)
+    parts = [MAGIC, struct.pack('<I', len(head)), head]
+    for values in arrays:
+        content = values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes()
+        parts.append(content + b'\0' * (-len(content) % 8))
+    return b''.join(parts)